@@ -15,19 +15,35 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+import os
+import sys
 import json       # working with json files
 import argparse   # command-line options
-import shutil
 import textwrap   # example text in argparse
 
 from scripts import config     # folder and files definitions
+from scripts.colors import palette_index   # flavor and accent names from colors.json
+from scripts.tweaks import load_tweaks      # tweaks registered in tweaks.json
 
-from scripts.utils import (
-    remove_files,  # delete already installed Marble theme
-    hex_to_rgba)   # convert HEX to RGBA
+# other modules are imported when they are used, so --help and local installs start faster
 
-from scripts.theme import Theme
-from scripts.gdm import GlobalTheme
+
+def positive_int(value):
+    """
+    Argument type for counts that must be at least 1
+    :param value: argument text
+    :return: integer
+    """
+
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {value!r}") from None
+
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+
+    return number
 
 
 def parse_args():
@@ -44,46 +60,80 @@ def parse_args():
                       -a                            all accent colors, all flavors
                       --all                         all accent colors, dark mode
                       --purple                      purple accent color, light mode
-                      --hue 150 --name coldgreen    custom coldgreen accent color, light & dark mode
+                      --accent-hex '#3a7bd5' --name brand   custom brand accent color, all flavors
+                      --accents-file accents.csv --mocha    custom accent colors from a file, dark mode
                       --red --green                 red, green accent colors
                     '''))
 
     # Default arguments
     parser.add_argument('-r', '--remove', action='store_true', help='remove all "Marble" themes')
 
+    flavor_names, accent_names = palette_index(config.colors_json)
+
     accentColors = parser.add_argument_group('Accent Colors')
     accentColors.add_argument('-a', '--all', action='store_true', help='all available accent colors')
-    accentColors.add_argument('--rosewater', action='store_true', help='Rosewater Accent Color')
-    accentColors.add_argument('--flamingo', action='store_true', help='Flamingo Accent Color')
-    accentColors.add_argument('--pink', action='store_true', help='Pink Accent Color')
-    accentColors.add_argument('--mauve', action='store_true', help='Mauve Accent Color')
-    accentColors.add_argument('--red', action='store_true', help='Red Accent Color')
-    accentColors.add_argument('--maroon', action='store_true', help='Maroon Accent Color')
-    accentColors.add_argument('--peach', action='store_true', help='Peach Accent Color')
-    accentColors.add_argument('--yellow', action='store_true', help='Yellow Accent Color')
-    accentColors.add_argument('--green', action='store_true', help='Green Accent Color')
-    accentColors.add_argument('--teal', action='store_true', help='Teal Accent Color')
-    accentColors.add_argument('--sky', action='store_true', help='Sky Accent Color')
-    accentColors.add_argument('--sapphire', action='store_true', help='Sapphire Accent Color')
-    accentColors.add_argument('--blue', action='store_true', help='Blue Accent Color')
-    accentColors.add_argument('--lavender', action='store_true', help='Lavender Accent Color')
+    for accent in accent_names:
+        accentColors.add_argument(f'--{accent}', action='store_true', help=f'{accent.capitalize()} Accent Color')
+
+    custom_args = parser.add_argument_group('Custom accent colors')
+    custom_args.add_argument('--accent-hex', metavar='HEX', help='custom accent color in #rrggbb format')
+    custom_args.add_argument('--name', help='name of custom accent color (used in theme name)')
+    custom_args.add_argument('--accents-file', metavar='FILE',
+                             help='custom accent colors from a .csv (name,hex) or .json ({"name": "hex"}) file')
 
     flavors = parser.add_argument_group('Flavors')
-    flavors.add_argument('--latte', action='store_true', help='latte flavor')
-    flavors.add_argument('--frappe', action='store_true', help='frappe flavor')
-    flavors.add_argument('--macchiato', action='store_true', help='macchiato flavor')
-    flavors.add_argument('--mocha', action='store_true', help='mocha flavor')
+    for flavor in flavor_names:
+        flavors.add_argument(f'--{flavor}', action='store_true', help=f'{flavor} flavor')
+
+    build_args = parser.add_argument_group('Build')
+    build_args.add_argument('-j', '--jobs', type=positive_int, default=None,
+                            help='number of parallel processes for generating themes (default: CPU count)')
+    build_args.add_argument('--force', action='store_true', help='rebuild themes even if they are up to date')
+    build_args.add_argument('--minify', action='store_true',
+                            help='minify theme styles (remove comments, whitespace and overridden styles)')
+    build_args.add_argument('--prune', action='store_true',
+                            help='remove styles for plain selectors with classes that installed gnome-shell styles '
+                                 'do not use (selectors of known extensions, like Dash to Dock, are kept)')
+    build_args.add_argument('--prune-report', metavar='FILE', help='save removed selectors to a json file')
+    build_args.add_argument('--tweak-matrix', action='store_true',
+                            help='install every combination of selected tweaks as separate themes '
+                                 '(Marble-mocha-blue-def-size+no-pill-, ...)')
+
+    build_args.add_argument('--watch', action='store_true',
+                            help='rebuild selected themes when theme or tweak files change')
+    build_args.add_argument('--reload', action='store_true',
+                            help='reload gnome-shell theme after rebuild in watch mode (uses the first selected theme)')
+
+    archive_args = parser.add_argument_group('Archive')
+    archive_args.add_argument('--export', dest='export_file', metavar='FILE',
+                              help='save themes to an archive (.tar.gz, .tar.xz, .tar.zst) instead of installing')
+    archive_args.add_argument('--import', dest='import_file', metavar='FILE',
+                              help='install themes from an archive, all or selected by accent/flavor arguments')
+
+    serve_args = parser.add_argument_group('Render server')
+    serve_args.add_argument('--serve', action='store_true',
+                            help='serve rendered theme files and variant archives on localhost over HTTP')
+    serve_args.add_argument('--port', type=int, default=8035, help='server port (default: 8035)')
+    serve_args.add_argument('--cache-size', type=int, default=64, metavar='MB',
+                            help='size of rendered variants kept in server memory (default: 64 MB)')
+
+    profile_args = parser.add_argument_group('Profiling')
+    profile_args.add_argument('--profile', action='store_true', help='print time of install stages')
+    profile_args.add_argument('--profile-report', metavar='FILE', help='save time of install stages to a json file')
+    profile_args.add_argument('--profile-output', metavar='FILE',
+                              help='save cProfile statistics of all function calls to a .prof file')
 
     gdm_theming = parser.add_argument_group('GDM theming')
     gdm_theming.add_argument('--gdm', action='store_true', help='install GDM theme. \
-                                    Requires root privileges. You must specify a specific color.')
+                                    Requires root privileges. You must specify a specific color. \
+                                    Exits with code 3 if the same theme is already installed.')
 
-    panel_args = parser.add_argument_group('Panel tweaks')
-    panel_args.add_argument('-Pds', '--panel_default_size', action='store_true', help='set default panel size')
-    panel_args.add_argument('-Pnp', '--panel_no_pill', action='store_true', help='remove panel button background')
+    tweak_groups = dict()  # {group title: argument group}
+    for name, tweak in load_tweaks(config.tweaks_json).items():
+        if tweak.group not in tweak_groups:
+            tweak_groups[tweak.group] = parser.add_argument_group(tweak.group or 'Tweaks')
 
-    overview_args = parser.add_argument_group('Overview tweaks')
-    overview_args.add_argument('--launchpad', action='store_true', help='change Show Apps icon to MacOS Launchpad icon')
+        tweak_groups[tweak.group].add_argument(*tweak.flags, dest=name, action='store_true', help=tweak.help)
 
     return parser.parse_args()
 
@@ -95,19 +145,59 @@ def apply_tweaks(args, theme):
     :param theme: Theme object
     """
 
-    if args.panel_default_size:
-        with open(f"{config.tweaks_folder}/panel/def-size.css", "r") as f:
-            theme += f.read()
+    for tweak in selected_tweaks(args):
+        theme.apply_tweak(tweak)
 
-    if args.panel_no_pill:
-        with open(f"{config.tweaks_folder}/panel/no-pill.css", "r") as f:
-            theme += f.read()
 
-    if args.launchpad:
-        with open(f"{config.tweaks_folder}/launchpad/launchpad.css", "r") as f:
-            theme += f.read()
+def selected_tweaks(args):
+    """
+    Collect tweaks from arguments
+    :param args: parsed arguments
+    :return: [Tweak, ...] in order of tweaks.json
+    """
+
+    return [tweak for name, tweak in load_tweaks(config.tweaks_json).items() if getattr(args, name, False)]
 
-        theme *= f"{config.tweaks_folder}/launchpad/launchpad.png"
+
+def tweak_matrix(args, theme):
+    """
+    Create themes with every combination of selected tweaks
+    :param args: parsed arguments
+    :param theme: Theme object without tweaks
+    :return: [Theme, ...], the first one has no tweaks
+    """
+
+    from itertools import combinations
+
+    tweaks = selected_tweaks(args)
+    return [theme.with_tweaks(combination)
+            for size in range(len(tweaks) + 1) for combination in combinations(tweaks, size)]
+
+
+def prune_styles(args, *themes):
+    """
+    Remove selectors that installed gnome-shell doesn't use
+    :param args: parsed arguments
+    :param themes: Theme objects with applied tweaks
+    """
+
+    from scripts.gdm import upstream_inventory
+    from scripts.cache import gnome_shell_version
+
+    gresource_file = f"{config.global_gnome_shell_theme}/{config.gnome_shell_gresource}"
+
+    try:
+        inventory = upstream_inventory(gresource_file)
+    except (OSError, ValueError) as err:
+        print(f"Can't read {gresource_file}, styles are not pruned: {err}")
+        return
+
+    pruned = list(dict.fromkeys(selector for theme in themes for selector in theme.prune(inventory)))
+    print(f"Pruned {len(pruned)} selectors unused by gnome-shell {gnome_shell_version()}.")
+
+    if args.prune_report:
+        with open(args.prune_report, "w") as report:
+            json.dump({"gnome-shell": gnome_shell_version(), "pruned": pruned}, report, indent=4)
 
 
 def install_theme(theme, flavor, accent, gdm=False):
@@ -118,9 +208,74 @@ def install_theme(theme, flavor, accent, gdm=False):
     :param theme_name: future theme name
     :param sat: color saturation
     :param gdm: if GDM theme
+    :return: install status
+    """
+
+    return theme.install(flavor, accent)
+
+
+def custom_accents(args, colors):
+    """
+    Collect and check custom accent colors from arguments
+    :param args: parsed arguments
+    :param colors: colors from colors.json
+    :return: {accent name: color}
+    """
+
+    from scripts.colors import normalize_hex
+    from scripts.palette import Palette, load_accents
+
+    accents = load_accents(args.accents_file) if args.accents_file else dict()
+
+    if args.accent_hex:
+        if not args.name:
+            raise ValueError("--accent-hex requires --name")
+        accents[args.name] = normalize_hex(args.accent_hex)
+
+    # names are checked like in installed palettes
+    palette = Palette(colors)
+    for name, color in accents.items():
+        palette.add_accent(name, color)
+
+    return accents
+
+
+def collect_variants(args):
+    """
+    Collect theme variants from arguments
+    :param args: parsed arguments
+    :return: [(flavor, accent), ...]
     """
 
-    theme.install(flavor, accent)
+    flavors, accents = palette_index(config.colors_json)
+    custom = list(args.custom_accents)
+
+    # custom accent colors are installed for every flavor if flavors are not selected
+    selected_flavors = [flavor for flavor in flavors if args.all or getattr(args, flavor)]
+    if custom and not selected_flavors:
+        selected_flavors = flavors
+
+    variants = list()  # (flavor, accent) to install
+    for flavor in selected_flavors:
+        for accent in accents:
+            if args.all or getattr(args, accent):
+                variants.append((flavor, accent))
+
+        variants.extend((flavor, accent) for accent in custom)
+
+    return variants
+
+
+def add_accents(args, palette):
+    """
+    Add custom accent colors to palette
+    :param args: parsed arguments
+    :param palette: Palette object
+    """
+
+    for name, color in args.custom_accents.items():
+        palette.add_accent(name, color)
+
 
 def apply_colors(args, theme, colors, gdm=False):
     """
@@ -129,33 +284,53 @@ def apply_colors(args, theme, colors, gdm=False):
     :param theme: Theme object
     :param colors: colors from colors.json
     :param gdm: if GDM theme
+    :return: install status of GDM theme, 1 if export fails
     """
-    accents = ["rosewater", "flamingo", "pink", "mauve", "red", "maroon", "peach", "yellow", "green", "teal", "sky", "sapphire", "blue", "lavender"]
-    flavors = ["latte", "frappe", "macchiato", "mocha"]
-    argsSpecified = False  # check if any color arguments specified
-    for flavor in flavors:
-        if args.all or getattr(args, flavor):
-            for accent in accents:
-                if args.all or getattr(args, accent):
-                    argsSpecified = True
-                    install_theme(theme, flavor, accent,  gdm)
-                    if gdm:
-                        return
-
-    if not argsSpecified:
+
+    variants = collect_variants(args)
+
+    if not variants:
         print('No accent/flavor arguments specified. Use -h or --help to see the available options.')
 
+    elif gdm:
+        return install_theme(theme, *variants[0], gdm)
+
+    else:
+        # tweak combinations share compiled files of the theme
+        themes = tweak_matrix(args, theme) if args.tweak_matrix else [theme]
+
+        # every combination is pruned with its own tweaks
+        if args.tweak_matrix and args.prune:
+            prune_styles(args, *themes)
+
+        if args.export_file:
+            from scripts.archive import export_themes
+
+            try:
+                export_themes(themes, variants, args.export_file)
+            except (OSError, ValueError) as err:
+                print(f"Error: {err}")
+                return 1
+        else:
+            for matrix_theme in themes:
+                matrix_theme.install_all(variants, jobs=args.jobs, force=args.force)
+
 
 def global_theme(args, colors):
     """
     Apply GDM theme
     :param args: parsed arguments
     :param colors: colors from colors.json
+    :return: exit code
     """
 
+    from scripts.gdm import GlobalTheme, current_status
+
     gdm_theme = GlobalTheme(colors, f"{config.raw_theme_folder}/{config.gnome_folder}",
                             config.global_gnome_shell_theme, config.gnome_shell_gresource,
-                            config.temp_folder, is_filled=args.filled)
+                            config.temp_folder, minify=args.minify, prune=args.prune)
+    for theme in (gdm_theme.light_theme, gdm_theme.dark_theme):
+        add_accents(args, theme.palette)
 
     if args.remove:
         gdm_rm_status = gdm_theme.remove()
@@ -164,14 +339,24 @@ def global_theme(args, colors):
         return 0
 
     try:
-        apply_colors(args, gdm_theme, colors, gdm=True)
+        status = apply_colors(args, gdm_theme, colors, gdm=True)
     except Exception as e:
         print(f"Error: {e}")
         return 1
-    else:
-        print("\nGDM theme installed successfully.")
-        print("You need to restart gdm.service to apply changes.")
-        print("Run \"systemctl restart gdm.service\" to restart GDM.")
+
+    # nothing is copied, so gdm.service doesn't need a restart
+    if status == current_status:
+        print("\nGDM theme is already current. No restart is needed.")
+        return current_status
+
+    # no accent or flavor is selected
+    if status is None:
+        return 1
+
+    print("\nGDM theme installed successfully.")
+    print("You need to restart gdm.service to apply changes.")
+    print("Run \"systemctl restart gdm.service\" to restart GDM.")
+    return 0
 
 
 def local_theme(args, colors):
@@ -179,16 +364,92 @@ def local_theme(args, colors):
     Apply local theme
     :param args: parsed arguments
     :param colors: colors from colors.json
+    :return: exit code
     """
 
     if args.remove:
+        from scripts.utils import remove_files
         remove_files()
 
+    # archive has rendered themes, only selected variants are unpacked
+    if args.import_file:
+        from tarfile import TarError
+        from scripts.archive import import_themes
+
+        variants = collect_variants(args)
+        try:
+            import_themes(args.import_file, os.path.expanduser(config.themes_folder),
+                          [f"{flavor}-{accent}" for flavor, accent in variants] if variants else None)
+        except (OSError, ValueError, TarError) as err:
+            print(f"Error: {err}")
+            return 1
+        return 0
+
+    # theme files are kept in memory and only changed files are read again
+    if args.watch:
+        variants = collect_variants(args)
+        if not variants:
+            print('No accent/flavor arguments specified. Use -h or --help to see the available options.')
+            return
+
+        from scripts.watch import ThemeWatcher
+        ThemeWatcher(lambda: create_theme(args, colors), variants,
+                     (config.raw_theme_folder, config.tweaks_folder), reload=args.reload).run()
+        return
+
+    return apply_colors(args, create_theme(args, colors), colors) or 0
+
+
+def create_theme(args, colors):
+    """
+    Create local theme with tweaks
+    :param args: parsed arguments
+    :param colors: colors from colors.json
+    :return: Theme object
+    """
+
+    from scripts.theme import Theme
+
     gnome_shell_theme = Theme("gnome-shell", colors, f"{config.raw_theme_folder}/{config.gnome_folder}",
-                              config.themes_folder, config.temp_folder)
+                              config.themes_folder)
+
+    gnome_shell_theme.minify = args.minify
+    add_accents(args, gnome_shell_theme.palette)
+
+    # tweak-matrix themes get tweaks and are pruned when they are installed
+    if not args.tweak_matrix:
+        apply_tweaks(args, gnome_shell_theme)
+
+        if args.prune:
+            prune_styles(args, gnome_shell_theme)
+
+    return gnome_shell_theme
+
+
+def instrument_stages(profiler):
+    """
+    Measure install stages
+    :param profiler: Profiler object
+    """
 
-    apply_tweaks(args, gnome_shell_theme)
-    apply_colors(args, gnome_shell_theme, colors)
+    from scripts import theme, gdm  # modules with measured functions
+    from scripts.theme import Theme
+    from scripts.gdm import GlobalTheme
+
+    profiler.instrument(sys.modules[__name__], "apply_tweaks")
+    profiler.instrument(theme, "generate_file")
+
+    profiler.instrument(Theme, "__init__", "Theme.__init__")
+    profiler.instrument(Theme, "_Theme__compile_templates", "Theme.__compile_templates")
+    profiler.instrument(Theme, "install", "Theme.install")
+    profiler.instrument(Theme, "install_all", "Theme.install_all")
+    profiler.instrument(Theme, "write", "Theme.write")
+
+    profiler.instrument(GlobalTheme, "_GlobalTheme__load_upstream", "GlobalTheme.__load_upstream")
+    profiler.instrument(GlobalTheme, "_GlobalTheme__clean_upstream", "GlobalTheme.__clean_upstream")
+    profiler.instrument(GlobalTheme, "_GlobalTheme__prepare", "GlobalTheme.__prepare")
+    profiler.instrument(gdm, "build_gresource", "compile gresource")
+    profiler.instrument(gdm, "copy_privileged", "copy to system")
 
 
 def main():
@@ -196,15 +457,45 @@ def main():
 
     colors = json.load(open(config.colors_json))
 
-    if args.gdm:
-        global_theme(args, colors)
+    # custom colors are read and checked once, before anything is installed
+    try:
+        args.custom_accents = custom_accents(args, colors)
+    except (OSError, ValueError) as err:
+        print(f"Error: {err}")
+        return 1
+
+    # functions are measured only with profiling arguments
+    profiler = None
+    if args.profile or args.profile_report or args.profile_output:
+        from scripts.profiler import Profiler
+        profiler = Profiler(profile_calls=bool(args.profile_output))
+        instrument_stages(profiler)
+        profiler.start()
+
+    status = 0
+
+    if args.serve:
+        from scripts.serve import ThemeServer
+        ThemeServer(args.port, args.cache_size << 20, minify=args.minify).run()
+
+    elif args.gdm:
+        status = global_theme(args, colors) or 0
 
     # if not GDM theme
     else:
-        local_theme(args, colors)
+        status = local_theme(args, colors) or 0
 
+    if profiler:
+        profiler.stop()
+        print("\n" + profiler.table())
 
-if __name__ == "__main__":
-    main()
+        if args.profile_report:
+            profiler.save_report(args.profile_report)
+        if args.profile_output:
+            profiler.save_calls(args.profile_output)
 
-    shutil.rmtree(config.temp_folder, ignore_errors=True)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
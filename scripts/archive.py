@@ -0,0 +1,245 @@
+import io
+import os
+import time
+import hashlib
+import tarfile
+import contextlib
+
+try:
+    import zstandard  # .tar.zst archives
+except ImportError:
+    zstandard = None
+
+from . import config  # name of folders and files
+from .utils import write_files, link_files, destination_return
+from .fileops import staging_folder, sync_files, replace_folder, remove_folder, remove_in_background
+from .manifest import manifest_content
+
+# archive extension: tarfile compression
+compressions = {".tar.gz": "gz", ".tgz": "gz", ".tar.bz2": "bz2", ".tar.xz": "xz", ".tar": ""}
+zstd_extension = ".tar.zst"
+
+
+def archive_extension(file):
+    """
+    Archive format by file name
+    :param file: archive location
+    :return: extension (.tar.gz, .tar.zst, ...)
+    """
+
+    for extension in (zstd_extension, *compressions):
+        if file.endswith(extension):
+            return extension
+
+    raise ValueError(f"Unknown archive format of {file}. Use {', '.join((zstd_extension, *compressions))}")
+
+
+@contextlib.contextmanager
+def open_archive(file, mode):
+    """
+    Open compressed tar archive as a stream, so it is read or written sequentially
+    :param file: archive location
+    :param mode: "r" or "w"
+    :return: TarFile object
+    """
+
+    extension = archive_extension(file)
+
+    if extension == zstd_extension and zstandard is None:
+        raise ValueError("zstandard module is required for .tar.zst archives. Install it with pip.")
+
+    with open(file, mode + "b") as f:
+        if extension == zstd_extension:
+            if mode == "w":
+                stream = zstandard.ZstdCompressor().stream_writer(f)
+            else:
+                stream = zstandard.ZstdDecompressor().stream_reader(f)
+
+            with stream, tarfile.open(fileobj=stream, mode=mode + "|") as archive:
+                yield archive
+
+        else:
+            with tarfile.open(fileobj=f, mode=f"{mode}|{compressions[extension]}") as archive:
+                yield archive
+
+
+def add_file(archive, name, content, mtime):
+    """
+    Add file from memory to archive
+    :param archive: TarFile object
+    :param name: file path in archive
+    :param content: file content
+    :param mtime: modification time
+    """
+
+    info = tarfile.TarInfo(name)
+    info.size = len(content)
+    info.mode = 0o644
+    info.mtime = mtime
+
+    archive.addfile(info, io.BytesIO(content))
+
+
+def add_link(archive, name, target, mtime):
+    """
+    Add hardlink to archive, linked file is stored once
+    :param archive: TarFile object
+    :param name: link path in archive
+    :param target: path of file in archive
+    :param mtime: modification time
+    """
+
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.LNKTYPE
+    info.linkname = target
+    info.mode = 0o644
+    info.mtime = mtime
+
+    archive.addfile(info)
+
+
+def export_themes(themes, variants, file):
+    """
+    Generate themes straight into an archive.
+    Files without colors are stored once in shared store folder, variants link to them.
+    :param themes: Theme objects, e.g. with different tweaks
+    :param variants: ((flavor, accent), ...)
+    :param file: archive location
+    """
+
+    mtime = int(time.time())
+    stored = set()  # shared files in archive
+
+    with open_archive(file, "w") as archive:
+        for theme, (flavor, accent) in ((theme, variant) for theme in themes for variant in variants):
+            name = theme.variant_name(flavor, accent)
+            print(f"Exporting {name} theme...", end=" ")
+
+            folder = destination_return("", name, theme.theme_type).strip("/")
+            rendered = theme.render(flavor, accent)
+
+            for apply_file, content in rendered.items():
+                if apply_file not in theme.static_files:
+                    add_file(archive, f"{folder}/{apply_file}", content, mtime)
+                    continue
+
+                # same name as in shared store of installed themes
+                stored_file = (f"{config.store_folder}/{theme.static_files[apply_file]}"
+                               f"{os.path.splitext(apply_file)[1]}")
+                if stored_file not in stored:
+                    add_file(archive, stored_file, content, mtime)
+                    stored.add(stored_file)
+
+                add_link(archive, f"{folder}/{apply_file}", stored_file, mtime)
+
+            # manifest is the last file of a variant, so imported themes are not rebuilt
+            manifest = manifest_content(theme.digest(flavor, accent), rendered).encode()
+            add_file(archive, f"{folder}/{config.manifest_file}", manifest, mtime)
+
+            print("Done.")
+
+
+def import_themes(file, destination, names=None):
+    """
+    Unpack themes from an archive in one sequential read
+    :param file: archive location
+    :param destination: themes folder
+    :param names: variant names (flavor-accent) to unpack, all by default
+    :return: list of unpacked variant names
+    """
+
+    store = os.path.join(destination, config.store_folder)
+    shared = dict()    # {path in archive: (digest, content)} of shared files
+    imported = list()
+    removals = list()  # threads deleting replaced folders
+    unpacked = set()   # variant folders in archive that are already unpacked
+
+    folder = None      # variant folder in archive
+    files = dict()     # {file name: content}
+    links = dict()     # {file name: (digest, content)}
+
+    def unpack():
+        if folder is None:
+            return
+
+        # folder is replaced as a whole, so its files must be stored together
+        if folder in unpacked:
+            raise ValueError(f"Invalid archive: files of {folder} are not stored together")
+        unpacked.add(folder)
+
+        # variant is unpacked to a staging folder that replaces installed one at once,
+        # so a failed import never leaves a partially replaced theme
+        variant_folder = os.path.normpath(os.path.join(destination, folder))
+        staging = staging_folder(variant_folder)
+
+        try:
+            write_files(staging, files)
+            link_files(store, staging, links)
+            sync_files(staging, files)
+            old_folder = replace_folder(staging, variant_folder)
+        except BaseException:
+            if os.path.lexists(staging):
+                remove_folder(staging)
+            raise
+
+        removal = remove_in_background(old_folder)
+        if removal:
+            removals.append(removal)
+
+        files.clear()
+        links.clear()
+
+    # replaced folders are deleted before import returns
+    try:
+        with open_archive(file, "r") as archive:
+            for member in archive:
+                path = os.path.normpath(member.name)
+                if os.path.isabs(path) or path.startswith(".."):
+                    raise ValueError(f"Unsafe path in archive: {member.name}")
+
+                if not member.isfile() and not member.islnk():
+                    continue
+
+                if path.startswith(config.store_folder + os.sep):
+                    # shared files are named by content digest, other names would poison the store
+                    content = archive.extractfile(member).read()
+                    digest = hashlib.sha256(content).hexdigest()
+                    if os.path.splitext(os.path.basename(path))[0] != digest:
+                        raise ValueError(f"Invalid archive: {member.name} doesn't match its content")
+
+                    shared[path] = (digest, content)
+                    continue
+
+                # Marble-flavor-accent-/theme type/file name
+                top_folder = path.split(os.sep)[0]
+                if (not top_folder.startswith("Marble-") or not top_folder.endswith("-")
+                        or len(top_folder) <= len("Marble--") or path == top_folder):
+                    raise ValueError(f"Invalid archive: {member.name} is not a Marble theme file")
+
+                variant = top_folder[len("Marble-"):-1]
+                if names is not None and variant not in names:
+                    continue
+
+                if os.path.dirname(path) != folder:
+                    unpack()
+                    folder = os.path.dirname(path)
+
+                if variant not in imported:
+                    print(f"Importing {variant} theme...")
+                    imported.append(variant)
+
+                if member.islnk():
+                    target = os.path.normpath(member.linkname)
+                    if target not in shared:
+                        raise ValueError(f"Invalid archive: {member.name} links to missing {member.linkname}")
+
+                    links[os.path.basename(path)] = shared[target]
+                else:
+                    files[os.path.basename(path)] = archive.extractfile(member).read()
+
+            unpack()
+    finally:
+        for removal in removals:
+            removal.join()
+
+    return imported
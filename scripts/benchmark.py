@@ -0,0 +1,224 @@
+# Benchmarks of theme install stages
+# Run from project folder: python -m scripts.benchmark [--save] [--baseline FILE]
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import contextlib
+
+from . import config
+from .theme import Theme
+from .gdm import GlobalTheme
+from .utils import generate_file, read_files
+from .gresource import build_gresource
+from .colors import palette_index
+from .tweaks import load_tweaks
+
+baseline_file = os.path.join(os.path.dirname(__file__), "benchmark.json")
+
+
+def measure(function, repeat, setup=None):
+    """
+    Run function several times, fast functions are run in a loop for every sample
+    :param function: function to measure
+    :param repeat: number of samples
+    :param setup: function called before every run, not measured
+    :return: {"min": seconds, "median": seconds} of one run
+    """
+
+    def sample(number):
+        elapsed = 0
+
+        for _ in range(number):
+            if setup:
+                setup()
+
+            # install functions report progress, it is not a part of benchmark
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                function()
+                elapsed += time.perf_counter() - start
+
+        return elapsed / number
+
+    # every sample takes at least 20 ms, so timer and scheduler noise is small
+    first = sample(1)
+    number = max(1, int(0.02 / first)) if first else 1
+    times = [sample(number) for _ in range(repeat)]
+
+    return {"min": min(times), "median": statistics.median(times)}
+
+
+class Benchmark:
+    def __init__(self, temp_folder, repeat=5):
+        """
+        Initialize Benchmark class
+        :param temp_folder: folder where themes are installed
+        :param repeat: number of runs of each stage
+        """
+
+        self.temp_folder = temp_folder
+        self.repeat = repeat
+        self.theme_folder = f"{config.raw_theme_folder}/{config.gnome_folder}"
+
+        with open(config.colors_json) as colors_json:
+            self.colors = json.load(colors_json)
+
+        flavors, accents = palette_index(config.colors_json)
+        self.variants = [(flavor, accent) for flavor in flavors for accent in accents]
+
+    def new_theme(self, destination="themes"):
+        """
+        Create theme with files read from disk
+        :param destination: subfolder of temp folder
+        :return: Theme object
+        """
+
+        generate_file.cache_clear()
+        read_files.cache_clear()
+
+        return Theme("gnome-shell", self.colors, self.theme_folder, f"{self.temp_folder}/{destination}")
+
+    def generate_file(self):
+        generate_file.cache_clear()
+        generate_file(f"{self.theme_folder}_css/")
+
+    def render(self):
+        theme = self.new_theme()
+        theme.render("mocha", "blue")
+
+    def write(self):
+        theme = self.new_theme()
+        rendered_colors = theme.palette.colors("mocha", "blue")
+        theme.render_colors(rendered_colors)  # compile templates before measuring
+
+        return lambda: theme.write(f"{self.temp_folder}/write", rendered_colors)
+
+    def tweaks(self):
+        theme = self.new_theme()
+
+        load_tweaks.cache_clear()
+        for tweak in load_tweaks(config.tweaks_json).values():
+            theme.apply_tweak(tweak)
+
+        theme.render("mocha", "blue")
+
+    def install_all(self):
+        theme = self.new_theme()
+        theme.install_all(self.variants, force=True)
+
+    def install_all_cached(self):
+        theme = self.new_theme()
+        theme.install_all(self.variants)
+
+    def gdm(self):
+        gresource_folder = f"{self.temp_folder}/gnome-shell"
+        shutil.rmtree(gresource_folder, ignore_errors=True)
+        os.makedirs(gresource_folder)
+
+        # default gnome styles of a similar size
+        gnome_styles = generate_file(f"{self.theme_folder}_css/").encode()
+        with open(f"{gresource_folder}/{config.gnome_shell_gresource}", "wb") as f:
+            f.write(build_gresource({
+                "/org/gnome/shell/theme/gnome-shell-light.css": gnome_styles,
+                "/org/gnome/shell/theme/gnome-shell-dark.css": gnome_styles,
+            }))
+
+        gdm_theme = GlobalTheme(self.colors, self.theme_folder, gresource_folder, config.gnome_shell_gresource,
+                                f"{self.temp_folder}/.temp")
+        gdm_theme.install("mocha", "blue")
+        del gdm_theme
+
+    def run(self):
+        """
+        Measure all stages
+        :return: {stage: {"min": seconds, "median": seconds}}
+        """
+
+        write = self.write()
+
+        return {
+            "generate_file": measure(self.generate_file, self.repeat),
+            "render": measure(self.render, self.repeat),
+            "write": measure(write, self.repeat),
+            "tweaks": measure(self.tweaks, self.repeat),
+            "install_all": measure(self.install_all, self.repeat),
+            "install_all_cached": measure(self.install_all_cached, self.repeat),
+            "gdm": measure(self.gdm, self.repeat,
+                           setup=lambda: shutil.rmtree(f"{self.temp_folder}/.cache", ignore_errors=True)),
+            "gdm_cached": measure(self.gdm, self.repeat),
+        }
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results with baseline
+    :param results: {stage: {"min": seconds, ...}}
+    :param baseline: results saved earlier
+    :param threshold: slowdown ratio that is counted as regression
+    :return: {stage: ratio}, list of regressed stages
+    """
+
+    ratios = dict()
+    regressions = list()
+
+    for stage, result in results.items():
+        if stage not in baseline:
+            continue
+
+        ratios[stage] = result["min"] / baseline[stage]["min"]
+        if ratios[stage] > threshold:
+            regressions.append(stage)
+
+    return ratios, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m scripts.benchmark", description="Benchmark theme install stages")
+    parser.add_argument('-n', '--repeat', type=int, default=5, help='number of runs of each stage')
+    parser.add_argument('--baseline', default=baseline_file, help='results to compare with')
+    parser.add_argument('--save', action='store_true', help='save results as new baseline')
+    parser.add_argument('--output', help='save results to a json file')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='slowdown ratio that is counted as regression (default: 1.5)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_folder:
+        os.environ["XDG_CACHE_HOME"] = f"{temp_folder}/.cache"  # gdm cache is not shared with user cache
+        results = Benchmark(temp_folder, args.repeat).run()
+
+    report = {"python": platform.python_version(), "cpus": os.cpu_count(), "results": results}
+
+    baseline = None
+    if not args.save and os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    ratios, regressions = compare(results, baseline, args.threshold) if baseline else (dict(), list())
+    report["baseline"] = ratios
+
+    print(f"{'stage':<20} {'min, ms':>10} {'median, ms':>12} {'baseline':>10}")
+    for stage, result in results.items():
+        ratio = f"{ratios[stage]:.2f}x" if stage in ratios else "-"
+        print(f"{stage:<20} {result['min'] * 1000:>10.1f} {result['median'] * 1000:>12.1f} {ratio:>10}")
+
+    for output in filter(None, (args.output, args.baseline if args.save else None)):
+        with open(output, "w") as f:
+            json.dump(report, f, indent=4)
+
+    if regressions:
+        print("Regressions: " + ", ".join(regressions))
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
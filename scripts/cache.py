@@ -0,0 +1,100 @@
+import os
+import shutil
+import hashlib
+import functools
+import subprocess
+
+from . import config
+from .fileops import remove_folder
+
+
+def cache_folder(*folders):
+    """
+    Folder in user cache directory
+    :param folders: subfolders
+    :return: cache folder location
+    """
+
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, config.cache_folder, *folders)
+
+
+def file_digest(file):
+    """
+    Digest of file content
+    :param file: file location
+    :return: hex digest
+    """
+
+    digest = hashlib.sha256()
+
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def gnome_shell_version():
+    """
+    Installed gnome-shell version
+    :return: version or "unknown"
+    """
+
+    if not shutil.which("gnome-shell"):
+        return "unknown"
+
+    try:
+        output = subprocess.run(["gnome-shell", "--version"], capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+    # "GNOME Shell 45.2"
+    return output.split()[-1] if output.split() else "unknown"
+
+
+def read_cached(cached):
+    """
+    Read cached file
+    :param cached: cached file location
+    :return: file content, or None if cache doesn't exist
+    """
+
+    try:
+        with open(cached, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def write_cached(cached, content):
+    """
+    Save file to cache, replacing other cached versions next to it
+    :param cached: cached file location
+    :param content: file content
+    """
+
+    parent = os.path.dirname(cached)
+    temp_cached = f"{cached}.{os.getpid()}"
+
+    try:
+        os.makedirs(parent, exist_ok=True)
+        with open(temp_cached, "wb") as f:
+            f.write(content)
+        os.replace(temp_cached, cached)
+
+        # only the current version is kept
+        for name in os.listdir(parent):
+            path = os.path.join(parent, name)
+            if path != cached:
+                if os.path.isdir(path):
+                    remove_folder(path)  # left by older versions
+                else:
+                    os.remove(path)
+
+    except OSError as err:
+        # theme can be installed without cache
+        print(f"Can't save cache to {cached}: {err}")
+        if os.path.exists(temp_cached):
+            os.remove(temp_cached)
@@ -0,0 +1,34 @@
+import re
+import json
+import functools
+
+# names and color codes are checked when arguments are parsed,
+# so this module doesn't import other modules of the package
+
+
+@functools.lru_cache(maxsize=None)
+def palette_index(colors_file):
+    """
+    Flavor and accent names from colors.json, read once per process
+    :param colors_file: colors.json location
+    :return: (flavor names, accent names)
+    """
+
+    with open(colors_file) as f:
+        colors_json = json.load(f)
+
+    flavors = tuple(name[1:] for name in colors_json if name.startswith("@"))
+    return flavors, tuple(colors_json["accents"])
+
+
+def normalize_hex(hex_color):
+    """
+    Check custom color
+    :param hex_color: color in #rrggbb or rrggbb format
+    :return: color in #rrggbb format
+    """
+
+    if not isinstance(hex_color, str) or not re.fullmatch(r"#?[0-9a-fA-F]{6}", hex_color.strip()):
+        raise ValueError(f"Invalid HEX color code: {hex_color!r}. Use #rrggbb format")
+
+    return "#" + hex_color.strip().lstrip("#").lower()
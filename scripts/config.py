@@ -1,7 +1,6 @@
 # folder definitions
 temp_folder = ".temp"
 gnome_folder = "gnome-shell"
-temp_gnome_folder = f"{temp_folder}/{gnome_folder}"
 tweaks_folder = "tweaks"
 themes_folder = "~/.themes"
 raw_theme_folder = "theme"
@@ -10,8 +9,12 @@ scripts_folder = "scripts"
 # GDM definitions
 global_gnome_shell_theme = "/usr/share/gnome-shell"
 gnome_shell_gresource = "gnome-shell-theme.gresource"
-extracted_gdm_folder = "theme"
 
 # files definitions
-gnome_shell_css = f"{temp_gnome_folder}/gnome-shell.css"
 colors_json = "colors.json"
+tweaks_json = f"{tweaks_folder}/tweaks.json"  # registered tweaks
+manifest_file = ".marble-manifest.json"
+store_folder = ".marble-store"  # files shared by all installed themes
+
+# cache definitions
+cache_folder = "marble-shell-theme"  # inside $XDG_CACHE_HOME or ~/.cache
@@ -0,0 +1,462 @@
+import re
+
+# url() with quoted or unquoted address, unquoted one can contain ; / and quotes of inline svg
+url_token = r"""[uU][rR][lL]\(\s*(?:"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|[^)]*)\s*\)"""
+
+# comments, strings and urls, block and declaration delimiters, other text
+token_pattern = re.compile(r"""/\*.*?\*/|"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|""" + url_token +
+                           r"""|[{};]|(?:[^{};"'/uU]|[uU](?![rR][lL]\())+|[/uU]""", re.S)
+important_pattern = re.compile(r"\s*!\s*important$", re.I)
+space_pattern = re.compile(r"\s+")
+
+
+class Comment:
+    def __init__(self, text):
+        """
+        CSS comment
+        :param text: comment with /* */
+        """
+
+        self.text = text
+
+    def __str__(self):
+        return self.text
+
+
+class Statement:
+    def __init__(self, text):
+        """
+        At-rule without block (@import url("file.css");)
+        :param text: statement without semicolon
+        """
+
+        self.text = text
+
+    def __str__(self):
+        return self.text + ";"
+
+
+class Declaration:
+    def __init__(self, name, value, important=False):
+        """
+        CSS declaration (color: red !important;)
+        :param name: property name
+        :param value: property value
+        :param important: if declaration has !important
+        """
+
+        self.name = name
+        self.value = value
+        self.important = important
+
+    def __str__(self):
+        return f"{self.name}: {self.value}{' !important' if self.important else ''};"
+
+
+class Rule:
+    def __init__(self, selector=None):
+        """
+        CSS rule or at-rule with block, stylesheet is a rule without selector
+        :param selector: rule selector or at-rule prelude (@media ...)
+        """
+
+        self.selector = selector
+        self.children = list()  # Declaration, Rule, Comment, Statement
+
+
+def parse_declaration(text):
+    """
+    Split declaration text into its parts
+    :param text: declaration without semicolon
+    :return: Declaration or Statement object
+    """
+
+    if text.startswith("@") or ":" not in text:
+        return Statement(text)
+
+    name, _, value = text.partition(":")
+    value, important = important_pattern.subn("", value.strip())
+
+    return Declaration(name.strip(), value, bool(important))
+
+
+def parse(content, *transforms):
+    """
+    Parse stylesheet in a single pass
+    :param content: CSS text
+    :param transforms: functions applied to every parsed node, return None to remove node
+    :return: stylesheet Rule object
+    """
+
+    stylesheet = Rule()
+    stack = [stylesheet]
+    text = list()  # tokens of current selector or declaration
+
+    def add(node):
+        for transform in transforms:
+            node = transform(node)
+            if node is None:
+                return
+
+        stack[-1].children.append(node)
+
+    for match in token_pattern.finditer(content):
+        token = match.group()
+
+        if token.startswith("/*"):
+            # comments inside selectors and values are dropped
+            if not "".join(text).strip():
+                add(Comment(token))
+
+        elif token == "{":
+            rule = Rule("".join(text).strip())
+            text.clear()
+
+            stack[-1].children.append(rule)
+            stack.append(rule)
+
+        elif token == ";" or token == "}":
+            declaration = "".join(text).strip()
+            text.clear()
+
+            if declaration:
+                add(parse_declaration(declaration))
+
+            if token == "}" and len(stack) > 1:
+                rule = stack.pop()
+
+                # rules are transformed after their content, rule is the last node of its parent
+                for transform in transforms:
+                    if transform(rule) is None:
+                        stack[-1].children.pop()
+                        break
+
+        elif token[0] in "\"'" or token[:4].lower() == "url(":
+            text.append(token)
+
+        else:
+            token = space_pattern.sub(" ", token)
+
+            # spaces around dropped comments
+            if text and text[-1].endswith(" ") and token.startswith(" "):
+                token = token[1:]
+
+            text.append(token)
+
+    return stylesheet
+
+
+def serialize(stylesheet, indent="    "):
+    """
+    Convert stylesheet back to CSS text
+    :param stylesheet: Rule object
+    :param indent: declaration indentation
+    :return: CSS text
+    """
+
+    lines = list()
+
+    def add(rule, level):
+        for node in rule.children:
+            if isinstance(node, Rule):
+                lines.append(f"{indent * level}{node.selector} {{")
+                add(node, level + 1)
+                lines.append(f"{indent * level}}}")
+            else:
+                lines.append(f"{indent * level}{node}")
+
+    add(stylesheet, 0)
+    lines.append("")
+
+    return "\n".join(lines)
+
+
+def drop_properties(*properties):
+    """
+    Transform that removes declarations of properties
+    :param properties: property names (exact match)
+    :return: transform function
+    """
+
+    properties = set(properties)
+
+    def transform(node):
+        if isinstance(node, Declaration) and node.name in properties:
+            return None
+        return node
+
+    return transform
+
+
+def drop_important(node):
+    """
+    Transform that removes !important from declarations
+    :param node: parsed node
+    :return: node
+    """
+
+    if isinstance(node, Declaration):
+        node.important = False
+
+    return node
+
+
+def drop_comments(*kept):
+    """
+    Transform that removes comments
+    :param kept: comments to keep (with /* */)
+    :return: transform function
+    """
+
+    kept = set(kept)
+
+    def transform(node):
+        if isinstance(node, Comment) and node.text not in kept:
+            return None
+        return node
+
+    return transform
+
+
+def fold_declarations(node):
+    """
+    Transform that keeps only declarations that are not overridden later in the same rule
+    :param node: parsed node
+    :return: node
+    """
+
+    if isinstance(node, Rule):
+        node.children = fold(node.children)
+
+    return node
+
+
+def fold(children):
+    """
+    Remove overridden declarations, the winning declaration stays in its place
+    :param children: nodes of a rule
+    :return: list of nodes
+    """
+
+    winners = dict()  # {property name: index of declaration}
+    for index, node in enumerate(children):
+        if isinstance(node, Declaration):
+            winner = winners.get(node.name)
+            if winner is None or node.important or not children[winner].important:
+                winners[node.name] = index
+
+    kept = set(winners.values())
+    return [node for index, node in enumerate(children) if not isinstance(node, Declaration) or index in kept]
+
+
+def is_style_rule(node):
+    """
+    Check if node is a rule with declarations only
+    :param node: parsed node
+    """
+
+    return (isinstance(node, Rule) and not node.selector.startswith("@")
+            and all(isinstance(child, Declaration) for child in node.children))
+
+
+def merge_rules(rule):
+    """
+    Merge rules of a stylesheet in place:
+    declarations overridden by a later rule with the same selector are removed,
+    neighbour rules with the same selector are merged,
+    neighbour rules with the same declarations are merged only if every selector is plain,
+    because St drops the whole rule when it can't parse one selector of a list
+    :param rule: stylesheet or at-rule
+    """
+
+    # overridden declarations, later rule always wins because it has the same specificity
+    overrides = dict()  # {selector: {property name: important}}
+    for node in reversed(rule.children):
+        if not is_style_rule(node):
+            if isinstance(node, Rule):
+                merge_rules(node)
+            continue
+
+        later = overrides.setdefault(node.selector, dict())
+        node.children = [declaration for declaration in node.children
+                         if declaration.name not in later or declaration.important and not later[declaration.name]]
+
+        for declaration in node.children:
+            later[declaration.name] = later.get(declaration.name, False) or declaration.important
+
+    children = list()
+    for node in rule.children:
+        if is_style_rule(node) and not node.children:
+            continue
+
+        previous = children[-1] if children else None
+
+        if is_style_rule(node) and is_style_rule(previous):
+            if previous.selector == node.selector:
+                previous.children = fold(previous.children + node.children)
+                continue
+
+            if (list(map(str, previous.children)) == list(map(str, node.children))
+                    and is_plain(previous.selector) and is_plain(node.selector)):
+                previous.selector += ", " + node.selector
+                continue
+
+        children.append(node)
+
+    rule.children = children
+
+
+def compact(text, pattern):
+    """
+    Remove spaces around separators outside of strings
+    :param text: selector or value
+    :param pattern: regex with string group and separator group
+    :return: compact text
+    """
+
+    return pattern.sub(lambda match: match.group(1) or match.group(2), text)
+
+
+string_group = r"""("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|""" + url_token + ")"
+selector_pattern = re.compile(string_group + r"|\s*([,>+~])\s*")
+value_pattern = re.compile(string_group + r"|\s*(,)\s*")
+
+
+def serialize_minified(stylesheet):
+    """
+    Convert stylesheet to CSS text without optional whitespace
+    :param stylesheet: Rule object
+    :return: CSS text
+    """
+
+    def block(rule):
+        parts = list()
+
+        for node in rule.children:
+            if isinstance(node, Rule):
+                parts.append(f"{compact(node.selector, selector_pattern)}{{{block(node)}}}")
+            elif isinstance(node, Declaration):
+                parts.append(f"{node.name}:{compact(node.value, value_pattern)}"
+                             f"{'!important' if node.important else ''};")
+            elif isinstance(node, Comment):
+                parts.append(f"\n{node}\n")  # kept comments are markers, they stay on their own line
+            else:
+                parts.append(str(node))
+
+        # last semicolon in a block is optional
+        if rule is not stylesheet and rule.children and isinstance(rule.children[-1], Declaration):
+            parts[-1] = parts[-1][:-1]
+
+        return "".join(parts)
+
+    return block(stylesheet)
+
+
+def minify(content, kept=()):
+    """
+    Remove comments and whitespace, fold overridden declarations and merge rules
+    :param content: CSS text
+    :param kept: comments to keep (with /* */)
+    :return: minified CSS text
+    """
+
+    stylesheet = parse(content, drop_comments(*kept), fold_declarations)
+    merge_rules(stylesheet)
+
+    return serialize_minified(stylesheet)
+
+
+name_pattern = re.compile(string_group + r"|\[[^\]]*\]|([.#]-?[_a-zA-Z][-\w]*)")
+list_pattern = re.compile(string_group + r"|([()\[\],])")
+plain_pattern = re.compile(r"[-\w.#:*>+~\s]+")  # type, class, id and simple pseudo-class selectors
+
+
+def is_plain(selector):
+    """
+    Check if every selector of a list has only type, class, id and simple pseudo-class parts
+    :param selector: selector text
+    :return: True if selector can be parsed by St
+    """
+
+    return all(plain_pattern.fullmatch(part) and "::" not in part for part in split_selectors(selector))
+
+
+def split_selectors(selector):
+    """
+    Split selector list on commas that are not inside strings, brackets or parentheses
+    :param selector: selector text
+    :return: list of selectors
+    """
+
+    selectors = list()
+    depth = start = 0
+
+    for match in list_pattern.finditer(selector):
+        token = match.group(2)
+        if token in ("(", "["):
+            depth += 1
+        elif token in (")", "]"):
+            depth -= 1
+        elif token == "," and depth == 0:
+            selectors.append(selector[start:match.start()].strip())
+            start = match.end()
+
+    selectors.append(selector[start:].strip())
+    return selectors
+
+
+def selector_names(selector):
+    """
+    Class and id names used in a selector
+    :param selector: selector text
+    :return: set of names with prefix (.class, #id)
+    """
+
+    return set(match.group(2) for match in name_pattern.finditer(selector) if match.group(2))
+
+
+def selector_inventory(content):
+    """
+    Collect class and id names used in a stylesheet
+    :param content: CSS text
+    :return: set of names with prefix (.class, #id)
+    """
+
+    names = set()
+
+    def collect(node):
+        if isinstance(node, Rule) and not node.selector.startswith("@"):
+            names.update(selector_names(node.selector))
+        return node
+
+    parse(content, collect)
+    return names
+
+
+def prune_selectors(inventory, pruned):
+    """
+    Transform that removes selectors with class or id names missing from inventory.
+    Only plain selectors are removed, selectors with attributes or functional pseudo-classes are kept.
+    :param inventory: set of names with prefix (.class, #id) that can be matched
+    :param pruned: list where removed selectors are added
+    :return: transform function
+    """
+
+    def transform(node):
+        if not isinstance(node, Rule) or node.selector.startswith("@"):
+            return node
+
+        selectors = list()
+        for selector in split_selectors(node.selector):
+            if not plain_pattern.fullmatch(selector) or selector_names(selector) <= inventory:
+                selectors.append(selector)
+            else:
+                pruned.append(selector)
+
+        if not selectors:
+            return None
+
+        node.selector = ", ".join(selectors)
+        return node
+
+    return transform
@@ -0,0 +1,227 @@
+import os
+import errno
+import ctypes
+import shutil
+import tempfile
+import threading
+import subprocess
+
+# errors after which file content is copied in user space
+fallback_errors = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM)
+
+
+def copy_content(source_fd, destination_fd, size):
+    """
+    Copy file content in kernel with copy_file_range or sendfile
+    :param source_fd: file descriptor to read from
+    :param destination_fd: file descriptor to write to
+    :param size: number of bytes to copy
+    :return: number of bytes that were not copied
+    """
+
+    for kernel_copy in ("copy_file_range", "sendfile"):
+        if not hasattr(os, kernel_copy):
+            continue
+
+        try:
+            while size > 0:
+                if kernel_copy == "copy_file_range":
+                    copied = os.copy_file_range(source_fd, destination_fd, size)
+                else:
+                    copied = os.sendfile(destination_fd, source_fd, None, size)
+
+                if copied == 0:
+                    break
+                size -= copied
+
+        except OSError as err:
+            if err.errno not in fallback_errors:
+                raise
+            continue
+
+        break
+
+    return size
+
+
+def copy_file(source, destination):
+    """
+    Copy file with its permissions, like cp -a
+    :param source: file to copy
+    :param destination: where file will be pasted
+    """
+
+    with open(source, "rb") as read_file, open(destination, "wb") as write_file:
+        left = copy_content(read_file.fileno(), write_file.fileno(), os.fstat(read_file.fileno()).st_size)
+
+        # copy the rest in user space, file positions are already moved by the kernel
+        if left:
+            shutil.copyfileobj(read_file, write_file)
+
+    shutil.copystat(source, destination)
+
+
+def remove_folder(folder):
+    """
+    Delete folder with its content, like rm -r
+    :param folder: folder to delete
+    """
+
+    shutil.rmtree(os.path.expanduser(folder))
+
+
+def remove_in_background(*folders):
+    """
+    Delete folders in another thread, Python waits for it before exit
+    :param folders: folders to delete, None is skipped
+    :return: Thread object, or None if there is nothing to delete
+    """
+
+    folders = [folder for folder in folders if folder]
+    if not folders:
+        return None
+
+    def remove():
+        for folder in folders:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    thread = threading.Thread(target=remove)
+    thread.start()
+    return thread
+
+
+def staging_folder(destination):
+    """
+    Create empty folder that will replace destination at once.
+    It is next to destination, so it is on the same filesystem.
+    Its name is unique, so installs of the same destination never share it.
+    :param destination: folder to replace
+    :return: staging folder location
+    """
+
+    destination = os.path.normpath(os.path.expanduser(destination))
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+
+    folder = tempfile.mkdtemp(dir=os.path.dirname(destination), prefix=f".{os.path.basename(destination)}.staging-")
+    os.chmod(folder, 0o755)  # mkdtemp creates private folders
+    return folder
+
+
+def sync_files(folder, files):
+    """
+    Flush written files of a folder to disk, all files are written before the first flush
+    :param folder: folder location
+    :param files: names of files to flush, other files were flushed before (shared files)
+    """
+
+    for file in files:
+        fd = os.open(os.path.join(folder, file), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    # file names are saved in folder
+    fd = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def exchange_folders(first, second):
+    """
+    Swap two folders atomically with renameat2(RENAME_EXCHANGE)
+    :param first: folder location
+    :param second: folder location
+    """
+
+    renameat2 = getattr(ctypes.CDLL(None, use_errno=True), "renameat2", None)
+    if renameat2 is None:
+        raise OSError(errno.ENOSYS, "renameat2 is not available")
+
+    at_fdcwd, rename_exchange = -100, 2
+    renameat2.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint)
+
+    if renameat2(at_fdcwd, os.fsencode(first), at_fdcwd, os.fsencode(second), rename_exchange):
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error), first, None, second)
+
+
+def replace_folder(source, destination):
+    """
+    Replace folder with another one, destination folder is never partially written
+    :param source: new folder
+    :param destination: folder to replace
+    :return: location of the old folder to delete, or None.
+             Old folder has a unique name, so it can be deleted while the same destination is replaced again.
+    """
+
+    if not os.path.lexists(destination):
+        os.rename(source, destination)
+        old_folder = None
+
+    else:
+        try:
+            exchange_folders(source, destination)
+            old_folder = source  # source has old files after exchange, its name is unique
+
+        except OSError as err:
+            if err.errno not in fallback_errors:
+                raise
+
+            # without exchange destination is missing for a moment
+            old_folder = tempfile.mkdtemp(dir=os.path.dirname(destination), prefix=f"{os.path.basename(source)}.old-")
+            os.rename(destination, old_folder)  # empty folder is replaced
+            os.rename(source, destination)
+
+    # folder names are saved in parent folder
+    fd = os.open(os.path.dirname(destination), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    return old_folder
+
+
+def is_writable(path):
+    """
+    Check if file can be written by current user
+    :param path: file location
+    """
+
+    if os.path.exists(path):
+        return os.access(path, os.W_OK)
+
+    return os.access(os.path.dirname(os.path.abspath(path)), os.W_OK)
+
+
+def copy_privileged(source, destination):
+    """
+    Copy file to a location that may require root privileges.
+    Copies in process if possible, otherwise runs sudo cp.
+    :param source: file to copy
+    :param destination: where file will be pasted
+    """
+
+    if is_writable(destination):
+        copy_file(source, destination)
+    else:
+        subprocess.run(["sudo", "cp", "-f", source, destination], check=True)
+
+
+def move_privileged(source, destination):
+    """
+    Move file in a location that may require root privileges.
+    Moves in process if possible, otherwise runs sudo mv.
+    :param source: file to move
+    :param destination: new file location
+    """
+
+    folders = (os.path.dirname(os.path.abspath(source)), os.path.dirname(os.path.abspath(destination)))
+
+    if all(os.access(folder, os.W_OK) for folder in folders):
+        os.replace(source, destination)
+    else:
+        subprocess.run(["sudo", "mv", "-f", source, destination], check=True)
@@ -1,22 +1,68 @@
 import os
-import subprocess
 import shutil
+import hashlib
 
 from .theme import Theme
-from .utils import label_files, remove_properties, remove_keywords
-from . import config
+from .css import parse, serialize, drop_properties, drop_important, selector_inventory
+from .fileops import copy_privileged, move_privileged
+from .gresource import read_gresource, parse_gresource, build_gresource
+from .cache import cache_folder, file_digest, gnome_shell_version, read_cached, write_cached
+
+
+backup_trigger = "\n/* Marble theme */\n"  # trigger to check if theme is installed
+theme_prefix = "/org/gnome/shell/theme/"  # resources of gnome-shell theme
+light_resource = f"{theme_prefix}gnome-shell-light.css"
+dark_resource = f"{theme_prefix}gnome-shell-dark.css"
+current_status = 3  # install status (and exit code) when installed theme is the same as built one
+removed_properties = ("background-color", "color", "box-shadow", "border-radius")  # replaced by Marble styles
+cleaner_version = 1  # increase when upstream styles are cleaned differently, so cached ones are rebuilt
+
+
+# names that gnome-shell styles don't use, but extensions or gnome-shell code set on actors.
+# Rules with these names are styled on purpose, so they are never pruned.
+kept_names = (
+    # Dash to Dock
+    "#dashtodockContainer", ".dashtodock", ".overview", ".focused", ".extended", ".shrink",
+    ".top", ".bottom", ".left", ".right",
+    # Dash to Panel
+    "#dashtopanelTaskbar", ".dashtopanelMainPanel", ".dtp-container",
+    # actor names set only in gnome-shell code
+    "#overviewGroup", "#lockDialogGroup", "#LookingGlassDialog", "#calendarArea", "#Toolbar",
+)
+
+
+def upstream_inventory(gresource_file):
+    """
+    Collect class and id names that can be matched: names used by installed gnome-shell styles
+    and kept names of extensions. Backup file is used if Marble theme is installed.
+    :param gresource_file: gnome-shell-theme.gresource location
+    :return: set of names with prefix (.class, #id)
+    """
+
+    with open(gresource_file, "rb") as f:
+        if backup_trigger.encode() in f.read():
+            gresource_file += ".backup"
+
+    inventory = set(kept_names)
+    for resource, content in read_gresource(gresource_file).items():
+        if resource.endswith(".css"):
+            inventory.update(selector_inventory(content.decode()))
+
+    return inventory
 
 
 class GlobalTheme:
     def __init__(self, colors_json, theme_folder, destination_folder, destination_file, temp_folder,
-                 is_filled=False):
+                 is_filled=False, minify=False, prune=False):
         """
         Initialize GlobalTheme class
         :param colors_json: location of a json file with colors
         :param theme_folder: raw theme location
         :param destination_folder: folder where themes will be installed
-        :param temp_folder: folder where files will be collected
+        :param temp_folder: folder where compiled gresource is saved before it is copied
         :param is_filled: if True, theme will be filled
+        :param minify: if True, theme styles will be minified
+        :param prune: if True, selectors unused by installed gnome-shell will be removed
         """
 
         self.colors_json = colors_json
@@ -26,27 +72,33 @@ class GlobalTheme:
         self.temp_folder = f"{temp_folder}/gdm"
 
         self.backup_file = f"{self.destination_file}.backup"
-        self.backup_trigger = "\n/* Marble theme */\n"  # trigger to check if theme is installed
-        self.extracted_theme = f"{self.temp_folder}/{config.extracted_gdm_folder}"
+        self.prune = prune
+        self.backup_trigger = backup_trigger
         self.gst = f"{self.destination_folder}/{self.destination_file}"  # use backup file if theme is installed
-        self.extracted_light_theme = f"{self.extracted_theme}/gnome-shell-light.css"
-        self.extracted_dark_theme = f"{self.extracted_theme}/gnome-shell-dark.css"
 
-        os.makedirs(self.temp_folder, exist_ok=True)  # create temp folder
-
-        # create theme
+        # create themes, their files are rendered to gresource in memory
+        self.light_theme = Theme("gnome-shell-light", self.colors_json, self.theme_folder,
+                                 self.temp_folder, is_filled=is_filled)
         self.dark_theme = Theme("gnome-shell-dark", self.colors_json, self.theme_folder,
-                                self.extracted_theme, self.temp_folder, is_filled=is_filled)
+                                self.temp_folder, is_filled=is_filled)
+
+        # installed theme is detected by trigger, so it is kept in minified styles
+        for theme in (self.light_theme, self.dark_theme):
+            theme.minify = minify
+            theme.markers.append(self.backup_trigger.strip())
 
     def __del__(self):
         """
         Delete temp folder
         """
 
-        del self.light_theme
-        del self.dark_theme
+        shutil.rmtree(self.temp_folder, ignore_errors=True)
 
-        shutil.rmtree(self.temp_folder)
+        # shared temp folder is removed when nothing else uses it
+        try:
+            os.rmdir(os.path.dirname(self.temp_folder))
+        except OSError:
+            pass
 
     def __is_installed(self):
         """
@@ -58,67 +110,90 @@ class GlobalTheme:
             content = f.read()
             return self.backup_trigger.encode() in content
 
-    def __extract(self):
+    def __clean_upstream(self, resources):
         """
-        Extract gresource files to temp folder
+        Remove styles from the gnome files that are replaced by Marble
+        :param resources: {resource path: content} of default theme, changed in place
         """
 
-        print("Extracting gresource files...")
-
-        gst = self.gst
-        workdir = self.temp_folder
+        # remove !important and properties from the gnome files in one pass
+        cleaned = dict()  # {content: cleaned content}, light and dark styles are often the same
 
-        # Get the list of resources
-        resources = subprocess.getoutput(f"gresource list {gst}").split("\n")
+        for resource in (light_resource, dark_resource):
+            content = resources[resource]
+            if content not in cleaned:
+                stylesheet = parse(content.decode(), drop_important, drop_properties(*removed_properties))
+                cleaned[content] = serialize(stylesheet).encode()
 
-        # Create directories
-        for r in resources:
-            r = r.replace("/org/gnome/shell/", "")
-            directory = os.path.join(workdir, os.path.dirname(r))
-            os.makedirs(directory, exist_ok=True)
+            resources[resource] = cleaned[content]
 
-        # Extract resources
-        for r in resources:
-            output_path = os.path.join(workdir, r.replace("/org/gnome/shell/", ""))
-            subprocess.run(f"gresource extract {gst} {r} > {output_path}", shell=True)
-
-    def __add_gnome_styles(self, theme):
+    def __load_upstream(self):
         """
-        Add gnome styles to the start of the file
-        :param theme: Theme object
+        Read and clean default theme resources, or reuse them from cache.
+        Cache is rebuilt when gresource file, gnome-shell version or cleaning rules change.
+        :return: {resource path: content}
         """
 
-        with open(f"{self.extracted_theme}/{theme.theme_type}.css", 'r') as gnome_theme:
-            gnome_styles = gnome_theme.read() + self.backup_trigger
-            theme.add_to_start(gnome_styles)
+        cleaner = hashlib.sha256(f"{cleaner_version}:{','.join(removed_properties)}".encode()).hexdigest()[:12]
+        cached_theme = cache_folder("gdm", f"{gnome_shell_version()}-{file_digest(self.gst)}-{cleaner}.gresource")
+
+        cached = read_cached(cached_theme)
+        if cached is not None:
+            try:
+                resources = parse_gresource(cached)
+            except ValueError:
+                resources = dict()
+
+            if light_resource in resources and dark_resource in resources:
+                print("Using cached gresource files...")
+                return resources
 
-    def __prepare(self, hue, color, sat=None):
+            print("Cached gresource files are corrupt.")
+
+        print("Extracting gresource files...")
+
+        # only theme resources are used in the new gresource
+        resources = {resource: content for resource, content in read_gresource(self.gst).items()
+                     if resource.startswith(theme_prefix)}
+        self.__clean_upstream(resources)
+
+        write_cached(cached_theme, build_gresource(resources))
+        return resources
+
+    def __prepare(self, flavor, accent, upstream):
         """
-        Generate theme files for gnome-shell-theme.gresource.xml
-        :param hue: color hue
-        :param color: color name
-        :param sat: color saturation
+        Generate theme files for gnome-shell-theme.gresource in memory
+        :param flavor: flavor name of the dark theme
+        :param accent: accent color name
+        :param upstream: {resource path: content} of cleaned default theme
+        :return: {resource path: content}
         """
 
+        light_styles = upstream[light_resource].decode()
+        dark_styles = upstream[dark_resource].decode()
+
         # add -light label to light theme files because they are installed to the same folder
-        label_files(self.light_theme.temp_folder, "light", self.light_theme.main_styles)
+        self.light_theme.label_files("light")
 
-        # remove !important from the gnome file
-        remove_keywords(self.extracted_light_theme, "!important")
-        remove_keywords(self.extracted_dark_theme, "!important")
+        # remove selectors that upstream styles don't use, before upstream styles are added
+        if self.prune:
+            inventory = set(kept_names)
+            for styles in {light_styles, dark_styles}:
+                inventory.update(selector_inventory(styles))
 
-        # remove properties from the gnome file
-        props_to_remove = ("background-color", "color", "box-shadow", "border-radius")
-        remove_properties(self.extracted_light_theme, *props_to_remove)
-        remove_properties(self.extracted_dark_theme, *props_to_remove)
+            print(f"Pruned {len(self.light_theme.prune(inventory))} unused selectors.")
+            self.dark_theme.prune(inventory)
 
         # add gnome styles to the start of the file
-        self.__add_gnome_styles(self.light_theme)
-        self.__add_gnome_styles(self.dark_theme)
+        self.light_theme.add_to_start(light_styles + self.backup_trigger)
+        self.dark_theme.add_to_start(dark_styles + self.backup_trigger)
+
+        resources = dict(upstream)
+        for theme, theme_flavor in ((self.light_theme, "latte"), (self.dark_theme, flavor)):
+            for file, content in theme.render(theme_flavor, accent).items():
+                resources[theme_prefix + file] = content
 
-        # build code for gnome-shell-theme.gresource.xml
-        self.light_theme.install(hue, color, sat, destination=self.extracted_theme)
-        self.dark_theme.install(hue, color, sat, destination=self.extracted_theme)
+        return resources
 
     def __backup(self):
         """
@@ -130,61 +205,50 @@ class GlobalTheme:
 
         # backup installed theme
         print("Backing up default theme...")
-        os.system(f"cp -aT {self.gst} {self.gst}.backup")
+        copy_privileged(self.gst, f"{self.gst}.backup")
 
-    def __generte_gresource_xml(self):
-        """
-        Generates.gresource.xml
-        """
-
-        # list of files to add to gnome-shell-theme.gresource.xml
-        files = list(f"<file>{file}</file>" for file in os.listdir(self.extracted_theme))
-        nl = "\n"  # fstring doesn't support newline character
-
-        ready_xml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<gresources>
-    <gresource prefix="/org/gnome/shell/theme">
-        {nl.join(files)}
-    </gresource>
-</gresources>"""
-
-        return ready_xml
-
-    def install(self, hue, sat=None):
+    def install(self, flavor, accent):
         """
         Install theme globally
-        :param hue: color hue
-        :param sat: color saturation
+        :param flavor: flavor name of the dark theme
+        :param accent: accent color name
+        :return: 0, or current_status if installed theme is already the same
         """
 
-        if self.__is_installed():
-            print("Theme is installed. Reinstalling...")
+        # Marble theme is built from the backup of the default theme
+        is_installed = self.__is_installed()
+        if is_installed:
             self.gst += ".backup"
 
-        self.__extract()
+        upstream = self.__load_upstream()
 
         # generate theme files for global theme
-        self.__prepare(hue, 'Marble', sat)
-
-        # generate gnome-shell-theme.gresource.xml
-        with open(f"{self.extracted_theme}/{self.destination_file}.xml", 'w') as gresource_xml:
-            generated_xml = self.__generte_gresource_xml()
-            gresource_xml.write(generated_xml)
+        resources = self.__prepare(flavor, accent, upstream)
 
-        # compile gnome-shell-theme.gresource.xml
+        # compile gnome-shell-theme.gresource
         print("Compiling theme...")
-        subprocess.run(f"glib-compile-resources {self.destination_file}.xml",
-                       shell=True, cwd=self.extracted_theme)
+        bundle = build_gresource(resources)
+
+        # identical theme is not copied, so gdm doesn't need a restart
+        installed_file = f"{self.destination_folder}/{self.destination_file}"
+        if file_digest(installed_file) == hashlib.sha256(bundle).hexdigest():
+            print("Installed theme is already current.")
+            return current_status
+
+        if is_installed:
+            print("Theme is installed. Reinstalling...")
 
         # backup installed theme
         self.__backup()
 
-        # install theme
+        # install theme, compiled file is copied with privileges if needed
         print("Installing theme...")
-        subprocess.run(["sudo", "cp", "-f", 
-                        f"{self.extracted_theme}/{self.destination_file}", 
-                        f"{self.destination_folder}/{self.destination_file}"], 
-                       check=True)
+        compiled_file = f"{self.temp_folder}/{self.destination_file}"
+        os.makedirs(self.temp_folder, exist_ok=True)
+        with open(compiled_file, "wb") as f:
+            f.write(bundle)
+
+        copy_privileged(compiled_file, installed_file)
 
         return 0
 
@@ -198,8 +262,8 @@ class GlobalTheme:
             print("Theme is installed. Removing...")
 
             if os.path.isfile(f"{self.destination_folder}/{self.backup_file}"):
-                subprocess.run(f"sudo mv {self.backup_file} {self.destination_file}",
-                               shell=True, cwd=self.destination_folder)
+                move_privileged(f"{self.destination_folder}/{self.backup_file}",
+                                f"{self.destination_folder}/{self.destination_file}")
 
             else:
                 print("Backup file not found. Try reinstalling gnome-shell package.")
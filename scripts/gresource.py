@@ -0,0 +1,335 @@
+import mmap
+import zlib
+import struct
+
+# GVDB file format, used by compiled GResource bundles
+gvdb_signature = b"GVariant"
+gvdb_header = struct.Struct("<8sIIII")        # signature, version, options, root start, root end
+hash_header = struct.Struct("<II")            # bloom words, buckets
+hash_item = struct.Struct("<IIIHccII")        # hash, parent, key start, key size, type, unused, value start, value end
+no_parent = 0xffffffff
+
+resource_type = b"(uuay)"  # size, flags, data
+resource_compressed = 1    # G_RESOURCE_FLAGS_COMPRESSED
+
+# GHashTable sizes, used to reproduce its iteration order
+prime_mod = (1, 2, 3, 7, 13, 31, 61, 127, 251, 509, 1021, 2039, 4093, 8191, 16381, 32749, 65521, 131071,
+             262139, 524287, 1048573, 2097143, 4194301, 8388593, 16777213, 33554393, 67108859, 134217689,
+             268435399, 536870909, 1073741789, 2147483647)
+
+
+def parse_gresource(data):
+    """
+    Extract all resources from a compiled GResource bundle in a single pass
+    :param data: content of .gresource file (bytes or mmap)
+    :return: {resource path: content}
+    :raise ValueError: if data is not a valid GResource bundle
+    """
+
+    try:
+        return _parse_resources(data)
+    except (struct.error, IndexError, zlib.error, RecursionError) as err:
+        raise ValueError(f"Corrupt GResource file: {err}") from None
+
+
+def _parse_resources(data):
+    """
+    Extract resources, errors of truncated or corrupt data are raised as is
+    :param data: content of .gresource file (bytes or mmap)
+    :return: {resource path: content}
+    """
+
+    signature, version, options, root_start, root_end = gvdb_header.unpack_from(data)
+    if signature != gvdb_signature:
+        raise ValueError("Not a GResource file")
+
+    bloom_words, buckets = hash_header.unpack_from(data, root_start)
+    items_start = root_start + hash_header.size + 4 * ((bloom_words & ((1 << 27) - 1)) + buckets)
+    items_count = (root_end - items_start) // hash_item.size
+
+    keys = list()     # (parent index, key)
+    values = dict()   # {item index: (value start, value end)}
+
+    for index in range(items_count):
+        (_, parent, key_start, key_size, item_type, _,
+         value_start, value_end) = hash_item.unpack_from(data, items_start + index * hash_item.size)
+
+        keys.append((parent, bytes(data[key_start:key_start + key_size]).decode()))
+        if item_type == b"v":
+            values[index] = (value_start, value_end)
+
+    paths = dict()  # {item index: full path}
+
+    def full_path(index):
+        if index not in paths:
+            parent, key = keys[index]
+            paths[index] = key if parent == no_parent else full_path(parent) + key
+        return paths[index]
+
+    resources = dict()
+
+    for index, (value_start, value_end) in values.items():
+        # value is a variant: serialized (uuay), zero byte, type string
+        value = data[value_start:value_end]
+        separator = value.rindex(b"\0")
+        if value[separator + 1:] != resource_type:
+            raise ValueError(f"Unknown resource type in {full_path(index)}")
+
+        size, flags = struct.unpack_from("<II", value)
+        content = value[8:separator]
+
+        if flags & resource_compressed:
+            resources[full_path(index)] = zlib.decompress(content)
+        else:
+            # uncompressed data is stored with a trailing zero byte
+            resources[full_path(index)] = bytes(content[:size])
+
+    return resources
+
+
+def read_gresource(file):
+    """
+    Extract all resources from a .gresource file without subprocesses
+    :param file: .gresource file location
+    :return: {resource path: content}
+    """
+
+    with open(file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return parse_gresource(data)
+
+
+def str_hash(key):
+    """
+    djb hash of a string, same as g_str_hash and GVDB hash
+    :param key: string
+    :return: 32-bit hash
+    """
+
+    hash_value = 5381
+    for char in key.encode():
+        # characters are signed in C
+        hash_value = (hash_value * 33 + (char - 256 if char > 127 else char)) & 0xffffffff
+
+    return hash_value
+
+
+class HashTableOrder:
+    def __init__(self):
+        """
+        Keys in the order GLib's GHashTable iterates them.
+        glib-compile-resources fills GVDB buckets in this order, so it is needed for identical output.
+        """
+
+        self.set_shift(3)
+        self.hashes = [0] * self.size  # 0 is unused, 1 is tombstone
+        self.keys = [None] * self.size
+        self.nnodes = 0
+        self.noccupied = 0
+
+    def set_shift(self, shift):
+        """
+        Set table size
+        :param shift: size is 2 ** shift
+        """
+
+        self.size = 1 << shift
+        self.mod = prime_mod[shift]
+        self.mask = self.size - 1
+
+    def hash_to_index(self, hash_value):
+        """
+        First place of a key in the table
+        :param hash_value: key hash
+        """
+
+        return ((hash_value * 11) & 0xffffffff) % self.mod
+
+    def insert(self, key):
+        """
+        Add key to the table
+        :param key: string
+        """
+
+        hash_value = max(str_hash(key), 2)
+        index = self.hash_to_index(hash_value)
+        step = 0
+
+        while self.hashes[index]:
+            if self.hashes[index] == hash_value and self.keys[index] == key:
+                return
+
+            step += 1
+            index = (index + step) & self.mask
+
+        self.hashes[index] = hash_value
+        self.keys[index] = key
+        self.nnodes += 1
+        self.noccupied += 1
+
+        if (self.size > self.nnodes * 4 and self.size > 1 << 3) or self.size <= self.noccupied + self.noccupied // 16:
+            self.resize()
+
+    def resize(self):
+        """
+        Change table size and move keys in place, like g_hash_table_resize
+        """
+
+        old_size = self.size
+
+        size = int(self.nnodes * 1.333)
+        shift = 0
+        while size:
+            size >>= 1
+            shift += 1
+        self.set_shift(max(shift, 3))
+
+        if self.size > old_size:
+            self.hashes += [0] * (self.size - old_size)
+            self.keys += [None] * (self.size - old_size)
+
+        moved = [False] * max(self.size, old_size)
+
+        for i in range(old_size):
+            node_hash = self.hashes[i]
+
+            if node_hash < 2:
+                self.hashes[i] = 0
+                continue
+
+            # already moved here by eviction
+            if moved[i]:
+                continue
+
+            self.hashes[i] = 0
+            key, self.keys[i] = self.keys[i], None
+
+            while True:
+                index = self.hash_to_index(node_hash)
+                step = 0
+
+                while moved[index]:
+                    step += 1
+                    index = (index + step) & self.mask
+
+                moved[index] = True
+
+                replaced_hash = self.hashes[index]
+                self.hashes[index] = node_hash
+
+                if replaced_hash < 2:
+                    self.keys[index] = key
+                    break
+
+                # evict key from its place and move it next
+                node_hash = replaced_hash
+                key, self.keys[index] = self.keys[index], key
+
+        if self.size < old_size:
+            del self.hashes[self.size:]
+            del self.keys[self.size:]
+
+        self.noccupied = self.nnodes
+
+    def __iter__(self):
+        return (key for hash_value, key in zip(self.hashes, self.keys) if hash_value >= 2)
+
+
+def build_gresource(resources, compressed=()):
+    """
+    Compile resources to a GResource bundle, like glib-compile-resources
+    :param resources: {resource path: content}
+    :param compressed: resource paths to compress with zlib
+    :return: content of .gresource file
+    """
+
+    # glib-compile-resources collects files to a hash table and inserts them to GVDB in its order
+    files = HashTableOrder()
+    for path in resources:
+        files.insert(path)
+
+    table = HashTableOrder()
+    parents = dict()  # {path: parent folder path}
+
+    def add_parent(path):
+        # "/org/gnome/file.css" -> "/org/gnome/" -> "/org/" -> "/"
+        if len(path) == 1:
+            return None
+
+        parent = path[:path.rindex("/", 0, len(path) - 1) + 1]
+        if parent not in parents:
+            table.insert(parent)
+            parents[parent] = add_parent(parent)
+
+        return parent
+
+    for path in files:
+        table.insert(path)
+        parents[path] = add_parent(path)
+
+    # items are prepended to buckets in table order
+    keys = list(table)
+    buckets = [list() for _ in keys]
+    for key in keys:
+        buckets[str_hash(key) % len(buckets)].insert(0, key)
+
+    items = [key for bucket in buckets for key in bucket]
+    indexes = {key: index for index, key in enumerate(items)}
+
+    children = dict()  # {folder path: [child path, ...]}
+    for key in sorted(items, key=str.encode):
+        if parents[key] is not None:
+            children.setdefault(parents[key], list()).append(key)
+
+    # file is a list of aligned chunks after the header
+    chunks = list()
+    offset = gvdb_header.size
+
+    def allocate(alignment, chunk):
+        nonlocal offset
+        offset += -offset & (alignment - 1)
+        chunks.append((offset, chunk))
+        offset += len(chunk)
+        return offset - len(chunk), offset
+
+    hash_table = bytearray(hash_header.size + 4 * len(buckets) + hash_item.size * len(items))
+    root = allocate(4, hash_table)
+
+    hash_header.pack_into(hash_table, 0, 5 << 27, len(buckets))  # bloom shift 5, no bloom words
+
+    index = 0
+    for bucket_index, bucket in enumerate(buckets):
+        struct.pack_into("<I", hash_table, hash_header.size + 4 * bucket_index, index)
+        index += len(bucket)
+
+    items_start = hash_header.size + 4 * len(buckets)
+
+    for index, key in enumerate(items):
+        parent = parents[key]
+        key_start, key_end = allocate(1, (key if parent is None else key[len(parent):]).encode())
+
+        if key in resources:
+            content = resources[key]
+
+            if key in compressed:
+                flags, data = resource_compressed, zlib.compress(content, 9)
+            else:
+                flags, data = 0, content + b"\0"
+
+            # variant with (uuay) value
+            value = allocate(8, struct.pack("<II", len(content), flags) + data + b"\0" + resource_type)
+            item_type = b"v"
+
+        else:
+            value = allocate(4, b"".join(struct.pack("<I", indexes[child]) for child in children[key]))
+            item_type = b"L"
+
+        hash_item.pack_into(hash_table, items_start + hash_item.size * index,
+                            str_hash(key), no_parent if parent is None else indexes[parent],
+                            key_start, key_end - key_start, item_type, b"\0", *value)
+
+    bundle = bytearray(gvdb_header.pack(gvdb_signature, 0, 0, *root))
+    for start, chunk in chunks:
+        bundle += bytes(start - len(bundle))  # alignment padding
+        bundle += chunk
+
+    return bytes(bundle)
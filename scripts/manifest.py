@@ -0,0 +1,136 @@
+import os
+import glob
+import json
+import hashlib
+
+from . import config
+
+
+def files_digest(files):
+    """
+    Digest of files content
+    :param files: {file name: content}
+    :return: hex digest
+    """
+
+    digest = hashlib.sha256()
+
+    for file in sorted(files):
+        content = files[file]
+        if isinstance(content, str):
+            content = content.encode()
+
+        digest.update(f"{file}\0{len(content)}\0".encode())
+        digest.update(content)
+
+    return digest.hexdigest()
+
+
+def variant_digest(sources_digest, flavor_colors, replaced_colors, tweaks):
+    """
+    Digest of everything that affects an installed variant
+    :param sources_digest: digest of theme files
+    :param flavor_colors: flavor colors from colors.json
+    :param replaced_colors: colors replaced in theme files, including derived ones
+    :param tweaks: names of enabled tweaks
+    :return: hex digest
+    """
+
+    inputs = json.dumps([sources_digest, flavor_colors, replaced_colors, sorted(tweaks)], sort_keys=True)
+    return hashlib.sha256(inputs.encode()).hexdigest()
+
+
+def is_up_to_date(destination, digest):
+    """
+    Check if installed variant was built from the same inputs
+    :param destination: installed theme folder
+    :param digest: digest of current inputs
+    :return: True if variant doesn't need to be rebuilt
+    """
+
+    destination = os.path.expanduser(destination)
+
+    try:
+        with open(os.path.join(destination, config.manifest_file)) as f:
+            manifest = json.load(f)
+
+    except (OSError, ValueError):
+        return False
+
+    if manifest.get("digest") != digest:
+        return False
+
+    # files could be deleted or changed by hand, even without changing their size
+    for file, file_digest in manifest.get("files", {}).items():
+        try:
+            with open(os.path.join(destination, file), "rb") as f:
+                if hashlib.sha256(f.read()).hexdigest() != file_digest:
+                    return False
+        except OSError:
+            return False
+
+    return True
+
+
+def manifest_files(destination):
+    """
+    Files of installed variant listed in its manifest
+    :param destination: installed theme folder
+    :return: list of file names, empty if there is no manifest
+    """
+
+    try:
+        with open(os.path.join(os.path.expanduser(destination), config.manifest_file)) as f:
+            return list(json.load(f).get("files", {}))
+    except (OSError, ValueError, AttributeError):
+        return list()
+
+
+def referenced_files(themes_folder):
+    """
+    Names of shared store files used by installed variants
+    :param themes_folder: folder with installed themes
+    :return: set of file names (digest and extension)
+    """
+
+    referenced = set()
+    pattern = os.path.join(glob.escape(os.path.expanduser(themes_folder)), "Marble-*", "*", config.manifest_file)
+
+    for manifest_file in glob.glob(pattern):
+        try:
+            with open(manifest_file) as f:
+                files = json.load(f).get("files", {})
+        except (OSError, ValueError, AttributeError):
+            continue
+
+        referenced.update(f"{file_digest}{os.path.splitext(file)[1]}" for file, file_digest in files.items())
+
+    return referenced
+
+
+def manifest_content(digest, files):
+    """
+    Build manifest of installed variant
+    :param digest: digest of inputs
+    :param files: {file name: content} of installed variant
+    :return: manifest json text
+    """
+
+    manifest = {
+        "digest": digest,
+        "files": {file: hashlib.sha256(content).hexdigest() for file, content in files.items()}
+    }
+
+    return json.dumps(manifest, indent=4, sort_keys=True)
+
+
+def write_manifest(destination, digest, files):
+    """
+    Save digest of inputs next to installed variant
+    :param destination: installed theme folder
+    :param digest: digest of inputs
+    :param files: {file name: content} of installed variant
+    """
+
+    with open(os.path.join(os.path.expanduser(destination), config.manifest_file), "w") as f:
+        f.write(manifest_content(digest, files))
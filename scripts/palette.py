@@ -0,0 +1,246 @@
+import os
+import csv
+import json
+import colorsys  # colorsys.hls_to_rgb(h, l, s)
+import functools
+
+from .colors import normalize_hex  # check custom colors
+
+
+# importing NumPy takes longer than computing fewer colors one by one,
+# so it is used only with many custom accents, never for the 14 standard ones
+numpy_min_colors = 64
+
+
+@functools.lru_cache(maxsize=None)
+def load_numpy():
+    """
+    Import NumPy on first use, it computes many colors at once
+    :return: numpy module or None if it is not installed
+    """
+
+    try:
+        import numpy
+    except ImportError:
+        return None
+
+    return numpy
+
+
+def adjust_lightness(hex_color, factor=1.1):
+    """
+    Change lightness of a color
+    :param hex_color: color in #rrggbb format
+    :param factor: lightness multiplier
+    :return: color in #rrggbb format
+    """
+
+    r, g, b = (int(hex_color[i:i + 2], 16) / 255.0 for i in (1, 3, 5))
+    h, l, s = colorsys.rgb_to_hls(r, g, b)
+    l = max(min(l * factor, 1.0), 0.0)
+    r, g, b = colorsys.hls_to_rgb(h, l, s)
+
+    return "#%02x%02x%02x" % (int(r * 255), int(g * 255), int(b * 255))
+
+
+def adjust_lightness_batch(hex_colors, factor=1.1):
+    """
+    Change lightness of several colors in one pass.
+    Uses NumPy for many colors if it is installed, results are the same as adjust_lightness.
+    :param hex_colors: colors in #rrggbb format
+    :param factor: lightness multiplier
+    :return: list of colors in #rrggbb format
+    """
+
+    numpy = load_numpy() if len(hex_colors) >= numpy_min_colors else None
+
+    if numpy is None:
+        return [adjust_lightness(hex_color, factor) for hex_color in hex_colors]
+
+    rgb = numpy.array([[int(hex_color[i:i + 2], 16) for i in (1, 3, 5)] for hex_color in hex_colors],
+                      dtype=float) / 255.0
+    r, g, b = rgb.T
+
+    # colorsys.rgb_to_hls
+    maxc = rgb.max(axis=1)
+    minc = rgb.min(axis=1)
+    sumc = maxc + minc
+    rangec = maxc - minc
+    l = sumc / 2.0
+    gray = minc == maxc
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        s = numpy.where(l <= 0.5, rangec / sumc, rangec / (2.0 - maxc - minc))
+        rc = (maxc - r) / rangec
+        gc = (maxc - g) / rangec
+        bc = (maxc - b) / rangec
+
+    h = numpy.where(r == maxc, bc - gc, numpy.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    h = numpy.where(gray, 0.0, (h / 6.0) % 1.0)
+    s = numpy.where(gray, 0.0, s)
+
+    l = numpy.maximum(numpy.minimum(l * factor, 1.0), 0.0)
+
+    # colorsys.hls_to_rgb
+    m2 = numpy.where(l <= 0.5, l * (1.0 + s), l + s - (l * s))
+    m1 = 2.0 * l - m2
+
+    def value(hue):
+        hue = hue % 1.0
+        return numpy.where(hue < 1.0 / 6.0, m1 + (m2 - m1) * hue * 6.0,
+                           numpy.where(hue < 0.5, m2,
+                                       numpy.where(hue < 2.0 / 3.0, m1 + (m2 - m1) * (2.0 / 3.0 - hue) * 6.0, m1)))
+
+    rgb = numpy.stack((value(h + 1.0 / 3.0), value(h), value(h - 1.0 / 3.0)), axis=1)
+    rgb = numpy.where((s == 0.0)[:, None], l[:, None], rgb)
+
+    return ["#%02x%02x%02x" % tuple(color) for color in (rgb * 255).astype(int).tolist()]
+
+
+def load_accents(file):
+    """
+    Read custom accent colors from a file
+    :param file: .json file ({name: color} or [{"name": name, "hex": color}, ...])
+                 or .csv file (name,hex lines, header is optional)
+    :return: {accent name: color in #rrggbb format}
+    """
+
+    accents = dict()  # {name: color}
+
+    def add(name, color, position):
+        if not isinstance(name, str):
+            raise ValueError(f"{file}: {position}: accent name must be a string")
+
+        try:
+            accents[name.strip()] = normalize_hex(color)
+        except ValueError as err:
+            raise ValueError(f"{file}: {position}: {err}") from None
+
+    with open(file, newline="") as f:
+        if os.path.splitext(file)[1].lower() == ".json":
+            try:
+                content = json.load(f)
+            except ValueError as err:
+                raise ValueError(f"{file}: invalid JSON: {err}") from None
+
+            if isinstance(content, dict):
+                for name, color in content.items():
+                    add(name, color, f"accent {name!r}")
+
+            elif isinstance(content, list):
+                for index, accent in enumerate(content):
+                    if not isinstance(accent, dict) or "name" not in accent or "hex" not in accent:
+                        raise ValueError(f"{file}: item {index}: expected {{\"name\": name, \"hex\": color}}")
+                    add(accent["name"], accent["hex"], f"item {index}")
+
+            else:
+                raise ValueError(f"{file}: expected an object or a list of accents")
+
+        else:
+            reader = csv.reader(f)
+            for row in reader:
+                if not row or row[0].startswith("#"):
+                    continue
+
+                # optional header
+                if reader.line_num == 1 and [cell.strip().lower() for cell in row[:2]] == ["name", "hex"]:
+                    continue
+
+                if len(row) != 2:
+                    raise ValueError(f"{file}: row {reader.line_num}: expected name,hex")
+                add(row[0], row[1], f"row {reader.line_num}")
+
+    return accents
+
+
+class Palette:
+    def __init__(self, colors_json):
+        """
+        Initialize Palette class
+        :param colors_json: colors from colors.json
+        """
+
+        self.flavors = {name: colors for name, colors in colors_json.items() if name.startswith("@")}
+        self.derived = colors_json.get("derived", dict())  # {keyword: rule}
+
+        self.custom = dict()  # {accent name: color} of accents that are not in colors.json
+        self.cache = dict()  # {(flavor, accent): colors}
+
+    @property
+    def keywords(self):
+        """
+        Every keyword that can be replaced in theme files
+        """
+
+        keywords = {"@accent-color"}
+        keywords.update(self.derived)
+        for flavor_colors in self.flavors.values():
+            keywords.update(flavor_colors)
+
+        return keywords
+
+    def add_accent(self, name, hex_color):
+        """
+        Add custom accent color for every flavor
+        :param name: accent name used in theme name
+        :param hex_color: color in #rrggbb format
+        """
+
+        # names are used in theme folder names and as color keywords
+        if not name or os.sep in name or name.startswith("."):
+            raise ValueError(f"Invalid custom accent name: {name!r}")
+
+        if any("@" + name in flavor_colors for flavor_colors in self.flavors.values()):
+            raise ValueError(f"Accent {name} already exists in colors.json")
+
+        self.custom[name] = normalize_hex(hex_color)
+        self.cache = {variant: colors for variant, colors in self.cache.items() if variant[1] != name}
+
+    def colors(self, flavor, accent):
+        """
+        Colors of a theme variant, computed once
+        :param flavor: flavor name
+        :param accent: accent color name
+        :return: {keyword: value}
+        """
+
+        if (flavor, accent) not in self.cache:
+            self.precompute(((flavor, accent),))
+
+        return dict(self.cache[(flavor, accent)])
+
+    def precompute(self, variants):
+        """
+        Compute colors of several variants, derived colors of all variants are computed in one pass
+        :param variants: ((flavor, accent), ...)
+        """
+
+        variants = list(dict.fromkeys(variant for variant in variants if variant not in self.cache))
+        variants_colors = list()
+
+        for flavor, accent in variants:
+            flavor_colors = self.flavors["@" + flavor]
+            accent_color = self.custom[accent] if accent in self.custom else flavor_colors["@" + accent]
+            variants_colors.append({**flavor_colors, "@accent-color": accent_color})
+
+        self.__derive(variants_colors)
+
+        for variant, colors in zip(variants, variants_colors):
+            self.cache[variant] = colors
+
+    def __derive(self, variants_colors):
+        """
+        Add derived colors from colors.json to variants
+        :param variants_colors: [{keyword: value}, ...], changed in place
+        """
+
+        for keyword, rule in self.derived.items():
+            source_colors = [colors[rule["from"]] for colors in variants_colors]
+
+            if "lightness" not in rule:
+                raise ValueError(f"Unknown rule for derived color {keyword}")
+
+            derived_colors = adjust_lightness_batch(source_colors, rule["lightness"])
+
+            for colors, derived_color in zip(variants_colors, derived_colors):
+                colors[keyword] = derived_color
@@ -0,0 +1,111 @@
+import json
+import time
+import cProfile
+import functools
+
+
+class Profiler:
+    def __init__(self, profile_calls=False):
+        """
+        Measure time of install stages.
+        Functions are wrapped only when profiler is used, so there is no overhead without it.
+        :param profile_calls: if True, all function calls are recorded with cProfile
+        """
+
+        self.stages = dict()  # {stage: [calls, seconds]}, in order of the first call
+        self.calls_profile = cProfile.Profile() if profile_calls else None
+        self.start_time = None
+        self.total = 0
+
+    def wrap(self, function, stage):
+        """
+        Measure time of every function call
+        :param function: function to wrap
+        :param stage: stage name
+        :return: wrapped function
+        """
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            measured = self.stages.setdefault(stage, [0, 0])
+            start = time.perf_counter()
+
+            try:
+                return function(*args, **kwargs)
+            finally:
+                measured[0] += 1
+                measured[1] += time.perf_counter() - start
+
+        return wrapper
+
+    def instrument(self, owner, name, stage=None):
+        """
+        Replace function of a class or module with measured one
+        :param owner: class or module
+        :param name: attribute name (_Class__method for private methods)
+        :param stage: stage name, attribute name by default
+        """
+
+        setattr(owner, name, self.wrap(getattr(owner, name), stage or name))
+
+    def start(self):
+        """
+        Start measuring total time and function calls
+        """
+
+        self.start_time = time.perf_counter()
+        if self.calls_profile:
+            self.calls_profile.enable()
+
+    def stop(self):
+        """
+        Stop measuring total time and function calls
+        """
+
+        if self.calls_profile:
+            self.calls_profile.disable()
+        self.total = time.perf_counter() - self.start_time
+
+    def report(self):
+        """
+        Measured stages
+        :return: {"total": seconds, "stages": {stage: {"calls": number, "seconds": seconds}}}
+        """
+
+        return {"total": self.total,
+                "stages": {stage: {"calls": calls, "seconds": seconds}
+                           for stage, (calls, seconds) in self.stages.items()}}
+
+    def table(self):
+        """
+        Measured stages as text table
+        :return: table text
+        """
+
+        lines = [f"{'stage':<32} {'calls':>6} {'time, ms':>10} {'share':>7}"]
+
+        for stage, (calls, seconds) in self.stages.items():
+            share = seconds / self.total * 100 if self.total else 0
+            lines.append(f"{stage:<32} {calls:>6} {seconds * 1000:>10.1f} {share:>6.1f}%")
+
+        lines.append(f"{'total':<32} {'':>6} {self.total * 1000:>10.1f}")
+        lines.append("Stages are measured in the main process, nested stages are included in their parents.")
+
+        return "\n".join(lines)
+
+    def save_report(self, file):
+        """
+        Save measured stages to a json file
+        :param file: json file location
+        """
+
+        with open(file, "w") as f:
+            json.dump(self.report(), f, indent=4)
+
+    def save_calls(self, file):
+        """
+        Save cProfile statistics, they can be opened with pstats or snakeviz
+        :param file: .prof file location
+        """
+
+        self.calls_profile.dump_stats(file)
@@ -0,0 +1,76 @@
+import os
+import json
+import threading
+
+from . import config  # name of folders and files
+from .theme import Theme
+from .tweaks import load_tweaks
+from .colors import palette_index
+
+# theme files are found next to scripts folder, so render works from any working directory
+project_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+compiled_themes = dict()  # {(tweaks, minify): Theme} of the whole process
+compile_lock = threading.Lock()
+
+
+def project_file(path):
+    """
+    :param path: file location from config
+    :return: location in project folder
+    """
+
+    return os.path.join(project_folder, path)
+
+
+def compiled_theme(tweaks=(), minify=False):
+    """
+    Theme with compiled templates, created once per process for every tweak set
+    :param tweaks: tweak names from tweaks.json
+    :param minify: if True, main styles are minified
+    :return: Theme object that must not be changed
+    """
+
+    key = (tuple(tweaks), minify)
+
+    with compile_lock:
+        if key not in compiled_themes:
+            registry = load_tweaks(project_file(config.tweaks_json))
+
+            unknown = [name for name in tweaks if name not in registry]
+            if unknown:
+                raise ValueError(f"Unknown tweaks: {', '.join(unknown)}. Available: {', '.join(registry)}")
+
+            if ((), minify) not in compiled_themes:
+                with open(project_file(config.colors_json)) as f:
+                    colors = json.load(f)
+
+                # destination is used only by install methods
+                theme_folder = project_file(f"{config.raw_theme_folder}/{config.gnome_folder}")
+                base_theme = Theme("gnome-shell", colors, theme_folder, config.themes_folder)
+                base_theme.minify = minify
+                compiled_themes[((), minify)] = base_theme.compile()
+
+            # tweak sets share compiled files of the base theme
+            base_theme = compiled_themes[((), minify)]
+            compiled_themes[key] = base_theme.with_tweaks([registry[name] for name in tweaks]).compile()
+
+        return compiled_themes[key]
+
+
+def render(flavor, accent, tweaks=(), minify=False):
+    """
+    Generate theme files in memory without writing anything.
+    Templates are compiled once per process, rendering is thread-safe.
+    :param flavor: flavor name
+    :param accent: accent color name
+    :param tweaks: tweak names from tweaks.json (panel_no_pill, launchpad, ...)
+    :param minify: if True, main styles are minified
+    :return: {file name: content}
+    """
+
+    flavors, accents = palette_index(project_file(config.colors_json))
+    if flavor not in flavors or accent not in accents:
+        raise ValueError(f"Unknown variant {flavor}-{accent}")
+
+    return compiled_theme(tweaks, minify).render(flavor, accent)
@@ -0,0 +1,275 @@
+import io
+import json
+import time
+import asyncio
+import tarfile
+import mimetypes
+import collections
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from . import config  # name of folders and files
+from .render import compiled_theme, project_file
+from .tweaks import load_tweaks
+from .colors import palette_index
+from .archive import add_file
+from .utils import destination_return
+from .manifest import manifest_content
+
+host = "127.0.0.1"  # rendered themes are served only to local clients
+reasons = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           500: "Internal Server Error"}
+
+
+class RenderCache:
+    def __init__(self, max_size):
+        """
+        Rendered variants, least recently used ones are removed when cache is full
+        :param max_size: maximum size of cached files in bytes
+        """
+
+        self.max_size = max_size
+        self.size = 0
+        self.entries = collections.OrderedDict()  # {key: (value, size)}, the last one is the newest
+
+    def get(self, key):
+        """
+        :param key: cache key
+        :return: cached value or None
+        """
+
+        if key not in self.entries:
+            return None
+
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    def put(self, key, value, size):
+        """
+        Add value to cache, values larger than cache are not stored
+        :param key: cache key
+        :param value: value to store
+        :param size: value size in bytes
+        """
+
+        if size > self.max_size:
+            return
+
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+
+        self.entries[key] = (value, size)
+        self.size += size
+
+        while self.size > self.max_size:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+
+
+def variant_archive(theme, flavor, accent, rendered, digest):
+    """
+    Pack rendered variant to a tar.gz archive that can be used with --import
+    :param theme: Theme object
+    :param flavor: flavor name
+    :param accent: accent color name
+    :param rendered: {file name: content}
+    :param digest: digest of variant inputs
+    :return: archive content
+    """
+
+    folder = destination_return("", theme.variant_name(flavor, accent), theme.theme_type).strip("/")
+    mtime = int(time.time())
+    buffer = io.BytesIO()
+
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for file in sorted(rendered):
+            add_file(archive, f"{folder}/{file}", rendered[file], mtime)
+
+        add_file(archive, f"{folder}/{config.manifest_file}", manifest_content(digest, rendered).encode(), mtime)
+
+    return buffer.getvalue()
+
+
+class ThemeServer:
+    def __init__(self, port, cache_size=64 << 20, minify=False):
+        """
+        Serve rendered theme files and variant archives over HTTP:
+        /                                               available flavors, accents and tweaks
+        /<flavor>/<accent>/<file>?tweaks=name,name      theme file
+        /<flavor>/<accent>.tar.gz?tweaks=name,name      whole variant
+        :param port: port on localhost
+        :param cache_size: maximum size of cached variants in bytes
+        :param minify: if True, main styles are minified
+        """
+
+        self.port = port
+        self.minify = minify
+        self.cache = RenderCache(cache_size)
+        self.pending = dict()  # {key: Future} of variants that are rendered now
+
+        self.flavors, self.accents = palette_index(project_file(config.colors_json))
+        self.tweaks = load_tweaks(project_file(config.tweaks_json))
+
+    async def variant(self, flavor, accent, query):
+        """
+        Check requested variant
+        :param flavor: flavor name
+        :param accent: accent color name
+        :param query: parsed query string
+        :return: (Theme object, digest)
+        """
+
+        if flavor not in self.flavors or accent not in self.accents:
+            raise LookupError(f"Unknown variant {flavor}-{accent}")
+
+        names = [name for value in query.get("tweaks", ()) for name in value.split(",") if name]
+        unknown = [name for name in names if name not in self.tweaks]
+        if unknown:
+            raise ValueError(f"Unknown tweaks: {', '.join(unknown)}")
+
+        # tweaks in the same order share one compiled theme, it is compiled once in a thread
+        tweaks = tuple(name for name in self.tweaks if name in names)
+        theme = await asyncio.get_running_loop().run_in_executor(None, compiled_theme, tweaks, self.minify)
+        return theme, theme.digest(flavor, accent)
+
+    async def rendered(self, key, function):
+        """
+        Rendered variant from cache, the same variant is rendered once for concurrent requests
+        :param key: cache key
+        :param function: function that renders variant in a thread, returns (value, size)
+        :return: cached value
+        """
+
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+
+        if key not in self.pending:
+            self.pending[key] = asyncio.ensure_future(asyncio.get_running_loop().run_in_executor(None, function))
+
+        try:
+            value, size = await asyncio.shield(self.pending[key])
+        finally:
+            self.pending.pop(key, None)
+
+        self.cache.put(key, value, size)
+        return value
+
+    async def route(self, path, query, known_etag=None):
+        """
+        Find response for a request
+        :param path: request path
+        :param query: parsed query string
+        :param known_etag: ETag that client has (If-None-Match), variant is not rendered if it matches
+        :return: (status, content type, body, etag)
+        """
+
+        parts = [unquote(part) for part in path.strip("/").split("/") if part]
+
+        if not parts:
+            index = {"flavors": self.flavors, "accents": self.accents, "tweaks": list(self.tweaks)}
+            return 200, "application/json", json.dumps(index).encode(), None
+
+        if len(parts) == 2 and parts[1].endswith(".tar.gz"):
+            flavor, accent = parts[0], parts[1][:-len(".tar.gz")]
+            theme, digest = await self.variant(flavor, accent, query)
+            if known_etag == f'"{digest}-tar"':
+                return 304, "application/gzip", b"", known_etag
+
+            def pack():
+                content = variant_archive(theme, flavor, accent, theme.render(flavor, accent), digest)
+                return content, len(content)
+
+            return 200, "application/gzip", await self.rendered((digest, "tar"), pack), f'"{digest}-tar"'
+
+        if len(parts) == 3:
+            flavor, accent, file = parts
+            theme, digest = await self.variant(flavor, accent, query)
+            content_type = mimetypes.guess_type(file)[0] or "application/octet-stream"
+            if known_etag == f'"{digest}"':
+                return 304, content_type, b"", known_etag
+
+            def render():
+                rendered = theme.render(flavor, accent)
+                return rendered, sum(len(content) for content in rendered.values())
+
+            rendered = await self.rendered((digest, "files"), render)
+            if file not in rendered:
+                raise LookupError(f"{file} is not found")
+
+            return 200, content_type, rendered[file], f'"{digest}"'
+
+        raise LookupError(f"{path} is not found")
+
+    async def handle(self, reader, writer):
+        """
+        Answer one HTTP request
+        :param reader: connection StreamReader
+        :param writer: connection StreamWriter
+        """
+
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+
+        lines = request.decode("latin-1").split("\r\n")
+        method, target = (lines[0].split(" ") + ["", ""])[:2]
+        headers = {name.strip().lower(): value.strip()
+                   for name, _, value in (line.partition(":") for line in lines[1:] if line)}
+
+        url = urlsplit(target)
+        etag = None
+
+        try:
+            if method not in ("GET", "HEAD"):
+                status, content_type, body = 405, "text/plain", b"Only GET and HEAD are supported\n"
+            else:
+                status, content_type, body, etag = await self.route(url.path, parse_qs(url.query),
+                                                                    headers.get("if-none-match"))
+
+        except LookupError as err:
+            status, content_type, body = 404, "text/plain", f"{err}\n".encode()
+        except ValueError as err:
+            status, content_type, body = 400, "text/plain", f"{err}\n".encode()
+        except Exception as err:
+            status, content_type, body = 500, "text/plain", f"{err}\n".encode()
+
+        response = [f"HTTP/1.1 {status} {reasons[status]}", f"Content-Type: {content_type}",
+                    f"Content-Length: {len(body)}", "Connection: close"]
+        if etag is not None:
+            response.append(f"ETag: {etag}")
+
+        writer.write(("\r\n".join(response) + "\r\n\r\n").encode())
+        if method != "HEAD":
+            writer.write(body)
+
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass  # client has disconnected
+        finally:
+            writer.close()
+
+        print(f"{method} {target} {status}")
+
+    async def serve(self):
+        """
+        Serve requests until cancelled
+        """
+
+        server = await asyncio.start_server(self.handle, host, self.port)
+        print(f"Serving themes on http://{host}:{self.port}/ Press Ctrl+C to stop.")
+
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        """
+        Serve requests until interrupted with Ctrl+C
+        """
+
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print()
@@ -0,0 +1,98 @@
+import re
+import functools
+
+
+class Template:
+    def __init__(self, content, keywords):
+        """
+        Split content into literal text and named color slots
+        :param content: text of a css/svg file
+        :param keywords: names of slots (@accent-color, @text, ...)
+        """
+
+        self.segments = list()  # literal text, slot positions are filled during rendering
+        self.slots = list()     # (index in segments, keyword)
+        self.literal_size = None  # size of literal text in bytes, counted on first use
+
+        # longest keywords go first, so @accent-color-hover is never read as @accent-color
+        keywords = sorted(set(keywords), key=len, reverse=True)
+        if not keywords:
+            self.segments.append(content)
+            return
+
+        pattern = re.compile("|".join(re.escape(keyword) for keyword in keywords))
+
+        position = 0
+        for match in pattern.finditer(content):
+            self.segments.append(content[position:match.start()])
+            self.slots.append((len(self.segments), match.group()))
+            self.segments.append(match.group())
+            position = match.end()
+
+        self.segments.append(content[position:])
+
+    @classmethod
+    def join(cls, templates):
+        """
+        Combine compiled templates without splitting their content again
+        :param templates: Template objects
+        :return: Template object
+        """
+
+        template = cls("", ())
+        template.segments.clear()
+
+        for other in templates:
+            offset = len(template.segments)
+            template.segments.extend(other.segments)
+            template.slots.extend((index + offset, keyword) for index, keyword in other.slots)
+
+        return template
+
+    @property
+    def keywords(self):
+        """
+        Keywords used in the template
+        """
+
+        return set(keyword for _, keyword in self.slots)
+
+    def render(self, values):
+        """
+        Fill slots with values
+        :param values: {keyword: replacement}, missing keywords are left as is
+        :return: rendered text
+        """
+
+        parts = self.segments.copy()
+        for index, keyword in self.slots:
+            parts[index] = values.get(keyword, keyword)
+
+        return "".join(parts)
+
+    def rendered_size(self, values):
+        """
+        Size of rendered text without rendering it
+        :param values: {keyword: replacement}, missing keywords are left as is
+        :return: size in bytes (UTF-8)
+        """
+
+        if self.literal_size is None:
+            slots = set(index for index, _ in self.slots)
+            self.literal_size = sum(len(segment.encode()) for index, segment in enumerate(self.segments)
+                                    if index not in slots)
+
+        return self.literal_size + sum(len(values.get(keyword, keyword).encode()) for _, keyword in self.slots)
+
+
+@functools.lru_cache(maxsize=32)
+def compile_template(content, keywords):
+    """
+    Template shared by the whole process, content is split once.
+    Templates are not changed after compilation, so they can be rendered from several threads.
+    :param content: text of a css/svg file
+    :param keywords: frozenset of slot names
+    :return: Template object
+    """
+
+    return Template(content, keywords)
@@ -1,10 +1,31 @@
 import unittest
 import os
+import io
+import contextlib
 import json
 import shutil
+import tarfile
+import subprocess
+from unittest import mock
 
 from . import config
 from .theme import Theme
+from .gdm import GlobalTheme, upstream_inventory, current_status, kept_names
+from .template import Template
+from .css import parse, serialize, minify, drop_properties, drop_important, selector_inventory, prune_selectors
+from .manifest import is_up_to_date
+from .fileops import copy_file, remove_folder
+from .gresource import read_gresource, build_gresource, parse_gresource
+from .colors import palette_index
+from .palette import Palette, load_accents, adjust_lightness, adjust_lightness_batch
+from .benchmark import compare
+from .profiler import Profiler
+from .archive import export_themes, import_themes, add_file, add_link
+from .watch import ThemeWatcher
+from .tweaks import load_tweaks
+from .render import render
+from .serve import ThemeServer, RenderCache
+from .utils import generate_file
 
 # folders
 tests_folder = '.tests'
@@ -20,7 +41,6 @@ class TestInstall(unittest.TestCase):
 
         # folders
         themes_folder = f"{tests_folder}/.themes"
-        temp_folder = f"{tests_folder}/.temp"
 
         # colors from colors.json
         colors_json = open(f"{project_folder}/{config.colors_json}")
@@ -30,26 +50,1000 @@ class TestInstall(unittest.TestCase):
         # create test theme
         test_theme = Theme("gnome-shell", colors,
                            f"{project_folder}/{config.raw_theme_folder}/{config.gnome_folder}",
-                           themes_folder, temp_folder, is_filled=True)
+                           themes_folder, is_filled=True)
 
         # install test theme
-        test_theme.install(120, 'test', 70)
+        test_theme.install('mocha', 'blue')
 
-        # folder with installed theme (.tests/.themes/Marble-test-light/gnome-shell)
-        installed_theme = f"{themes_folder}/{os.listdir(themes_folder)[0]}/{config.gnome_folder}"
+        # folder with installed theme (.tests/.themes/Marble-mocha-blue-/gnome-shell)
+        installed_theme = f"{themes_folder}/Marble-mocha-blue-/{config.gnome_folder}"
 
         # check if files are installed
         for file in os.listdir(installed_theme):
             with open(f"{installed_theme}/{file}") as f:
                 read_file = f.read()
 
-                for color in colors["elements"]:
+                for color in test_theme.keywords:
                     self.assertNotIn(color, read_file, msg=f"Color {color} is not replaced in {file}")
 
         # delete test theme
         del test_theme
         shutil.rmtree(tests_folder)
 
+    def test_install_parallel(self):
+        """
+        Test if themes generated in parallel are the same as rendered ones
+        """
+
+        themes_folder = f"{tests_folder}/.themes"
+
+        with open(f"{project_folder}/{config.colors_json}") as colors_json:
+            colors = json.load(colors_json)
+
+        test_theme = Theme("gnome-shell", colors,
+                           f"{project_folder}/{config.raw_theme_folder}/{config.gnome_folder}",
+                           themes_folder)
+
+        variants = [("latte", "red"), ("mocha", "blue"), ("frappe", "teal")]
+        test_theme.install_all(variants, jobs=2)
+
+        for flavor, accent in variants:
+            installed_theme = f"{themes_folder}/Marble-{flavor}-{accent}-/{config.gnome_folder}"
+
+            for file, content in test_theme.render(flavor, accent).items():
+                with open(f"{installed_theme}/{file}", "rb") as f:
+                    self.assertEqual(f.read(), content, msg=f"{file} differs in {flavor}-{accent}")
+
+        shutil.rmtree(tests_folder)
+
+    def test_build_cache(self):
+        """
+        Test if installed theme is skipped only while its inputs are the same
+        """
+
+        themes_folder = f"{tests_folder}/.themes"
+
+        with open(f"{project_folder}/{config.colors_json}") as colors_json:
+            colors = json.load(colors_json)
+
+        test_theme = Theme("gnome-shell", colors,
+                           f"{project_folder}/{config.raw_theme_folder}/{config.gnome_folder}",
+                           themes_folder)
+        test_theme.install('mocha', 'blue')
+
+        installed_theme = f"{themes_folder}/Marble-mocha-blue-/{config.gnome_folder}"
+        with open(f"{installed_theme}/{config.manifest_file}") as f:
+            digest = json.load(f)["digest"]
+
+        self.assertTrue(is_up_to_date(installed_theme, digest))
+
+        # changed file is rebuilt, even if its size is the same
+        with open(f"{installed_theme}/gnome-shell.css", "r+b") as f:
+            f.write(b"x")
+        self.assertFalse(is_up_to_date(installed_theme, digest))
+
+        # files of the previous build that are no longer generated are removed, other files are kept
+        with open(f"{installed_theme}/{config.manifest_file}") as f:
+            manifest = json.load(f)
+        manifest["files"]["stale.svg"] = ""
+        with open(f"{installed_theme}/{config.manifest_file}", "w") as f:
+            json.dump(manifest, f)
+
+        for file in ("stale.svg", "user.svg"):
+            with open(f"{installed_theme}/{file}", "w") as f:
+                f.write("<svg/>")
+
+        test_theme.write(installed_theme, test_theme.palette.colors('mocha', 'blue'), digest)
+        self.assertFalse(os.path.exists(f"{installed_theme}/stale.svg"))
+        self.assertTrue(os.path.exists(f"{installed_theme}/user.svg"))
+
+        # tweak changes digest
+        test_theme += "#panel { height: 0; }"
+        test_theme.tweaks.append("test")
+        test_theme.install('mocha', 'blue')
+
+        with open(f"{installed_theme}/{config.manifest_file}") as f:
+            self.assertNotEqual(json.load(f)["digest"], digest)
+
+        shutil.rmtree(tests_folder)
+
+    def test_shared_store(self):
+        """
+        Test if files without colors are shared between installed themes
+        """
+
+        themes_folder = f"{tests_folder}/.themes"
+
+        with open(f"{project_folder}/{config.colors_json}") as colors_json:
+            colors = json.load(colors_json)
+
+        test_theme = Theme("gnome-shell", colors,
+                           f"{project_folder}/{config.raw_theme_folder}/{config.gnome_folder}",
+                           themes_folder)
+        test_theme.install('mocha', 'blue')
+        test_theme.install('latte', 'red')
+
+        mocha_theme = f"{themes_folder}/Marble-mocha-blue-/{config.gnome_folder}"
+        latte_theme = f"{themes_folder}/Marble-latte-red-/{config.gnome_folder}"
+
+        self.assertTrue(test_theme.static_files)
+        for file in test_theme.static_files:
+            self.assertTrue(os.path.samefile(f"{mocha_theme}/{file}", f"{latte_theme}/{file}"),
+                            msg=f"{file} is not shared")
+
+        # files with colors are not shared
+        self.assertFalse(os.path.samefile(f"{mocha_theme}/gnome-shell.css", f"{latte_theme}/gnome-shell.css"))
+
+        # shared file changed through one link is replaced in the store, unused store files are removed
+        file = next(iter(test_theme.static_files))
+        with open(f"{mocha_theme}/{file}", "a") as f:
+            f.write("<!-- edited -->")
+        with open(f"{themes_folder}/{config.store_folder}/unused.svg", "w") as f:
+            f.write("<svg/>")
+
+        test_theme.install_all((('mocha', 'blue'), ('latte', 'red')), jobs=1)
+
+        rendered = test_theme.render('mocha', 'blue')[file]
+        for theme_folder in (mocha_theme, latte_theme):
+            with open(f"{theme_folder}/{file}", "rb") as f:
+                self.assertEqual(f.read(), rendered)
+        self.assertTrue(os.path.samefile(f"{mocha_theme}/{file}", f"{latte_theme}/{file}"))
+        self.assertFalse(os.path.exists(f"{themes_folder}/{config.store_folder}/unused.svg"))
+
+        shutil.rmtree(tests_folder)
+
+    def test_staged_install(self):
+        """
+        Test if installed theme is replaced at once, and is left as is when install fails
+        """
+
+        themes_folder = f"{tests_folder}/.themes"
+        destination = f"{themes_folder}/Marble-mocha-blue-/{config.gnome_folder}"
+
+        with open(f"{project_folder}/{config.colors_json}") as colors_json:
+            colors = json.load(colors_json)
+
+        test_theme = Theme("gnome-shell", colors,
+                           f"{project_folder}/{config.raw_theme_folder}/{config.gnome_folder}",
+                           themes_folder)
+        replaced_colors = test_theme.palette.colors('mocha', 'blue')
+
+        self.assertIsNone(test_theme.write(destination, replaced_colors, shared=True, staged=True))
+        with open(f"{destination}/stale.css", "w") as f:
+            f.write("/* file from older version */")
+
+        old_folder = test_theme.write(destination, replaced_colors, shared=True, staged=True)
+        self.assertTrue(os.path.isfile(f"{old_folder}/stale.css"))
+        self.assertFalse(os.path.exists(f"{destination}/stale.css"))
+        remove_folder(old_folder)
+
+        # failed install doesn't touch installed theme
+        with mock.patch("scripts.theme.sync_files", side_effect=OSError("disk is full")):
+            with self.assertRaises(OSError):
+                test_theme.write(destination, test_theme.palette.colors('latte', 'red'), shared=True, staged=True)
+
+        self.assertEqual(os.listdir(os.path.dirname(destination)), [config.gnome_folder])
+        with open(f"{destination}/gnome-shell.css", "rb") as f:
+            self.assertEqual(f.read(), test_theme.render_colors(replaced_colors)["gnome-shell.css"])
+
+        # repeated installs don't reuse a folder that is still being deleted
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            for _ in range(20):
+                test_theme.install_all((('mocha', 'blue'),), force=True)
+
+        self.assertNotIn("Error", output.getvalue())
+        self.assertEqual(sorted(os.listdir(themes_folder)), [config.store_folder, "Marble-mocha-blue-"])
+
+        shutil.rmtree(tests_folder)
+
+    def test_export_import(self):
+        """
+        Test if exported themes are imported with shared files and are up to date
+        """
+
+        themes_folder = f"{tests_folder}/.themes"
+        archive = f"{tests_folder}/themes.tar.gz"
+        os.makedirs(tests_folder, exist_ok=True)
+
+        with open(f"{project_folder}/{config.colors_json}") as colors_json:
+            colors = json.load(colors_json)
+
+        test_theme = Theme("gnome-shell", colors,
+                           f"{project_folder}/{config.raw_theme_folder}/{config.gnome_folder}",
+                           themes_folder)
+        export_themes([test_theme], (('mocha', 'blue'), ('latte', 'red'), ('frappe', 'red')), archive)
+        self.assertFalse(os.path.exists(themes_folder))
+
+        self.assertEqual(import_themes(archive, themes_folder, ["mocha-blue", "frappe-red"]),
+                         ["mocha-blue", "frappe-red"])
+        self.assertEqual(sorted(os.listdir(themes_folder)),
+                         [config.store_folder, "Marble-frappe-red-", "Marble-mocha-blue-"])
+
+        mocha_theme = f"{themes_folder}/Marble-mocha-blue-/{config.gnome_folder}"
+        for file, content in test_theme.render('mocha', 'blue').items():
+            with open(f"{mocha_theme}/{file}", "rb") as f:
+                self.assertEqual(f.read(), content, msg=f"{file} is different")
+
+        file = next(iter(test_theme.static_files))
+        self.assertTrue(os.path.samefile(f"{mocha_theme}/{file}",
+                                         f"{themes_folder}/Marble-frappe-red-/{config.gnome_folder}/{file}"))
+
+        self.assertTrue(is_up_to_date(mocha_theme, test_theme.digest('mocha', 'blue')))
+
+        # imported variant replaces installed folder as a whole
+        with open(f"{mocha_theme}/stale.svg", "w") as f:
+            f.write("<svg/>")
+        import_themes(archive, themes_folder, ["mocha-blue"])
+        self.assertFalse(os.path.exists(f"{mocha_theme}/stale.svg"))
+        self.assertEqual(sorted(os.listdir(f"{themes_folder}/Marble-mocha-blue-")), [config.gnome_folder])
+
+        # shared files must match their digest names, links must point to them
+        invalid_archives = ({f"{config.store_folder}/{'0' * 64}.svg": b"<svg/>"},
+                            {"notes.txt": b"text"},
+                            {"Marble-mocha-blue-/gnome-shell/a.svg": f"{config.store_folder}/missing.svg"})
+        for members in invalid_archives:
+            with tarfile.open(archive, "w:gz") as f:
+                for name, content in members.items():
+                    if isinstance(content, bytes):
+                        add_file(f, name, content, 0)
+                    else:
+                        add_link(f, name, content, 0)
+
+            self.assertRaisesRegex(ValueError, "Invalid archive", import_themes, archive, themes_folder)
+
+        shutil.rmtree(tests_folder)
+
+    def test_tweak_matrix(self):
+        """
+        Test if tweak combinations are rendered like tweaks added as text and installed separately
+        """
+
+        themes_folder = f"{tests_folder}/.themes"
+
+        with open(f"{project_folder}/{config.colors_json}") as colors_json:
+            colors = json.load(colors_json)
+
+        tweaks = load_tweaks(f"{project_folder}/{config.tweaks_json}")
+        self.assertIn("launchpad.png", tweaks["launchpad"].assets)
+
+        test_theme = Theme("gnome-shell", colors,
+                           f"{project_folder}/{config.raw_theme_folder}/{config.gnome_folder}",
+                           themes_folder)
+        test_theme.render('mocha', 'blue')
+
+        tweaked_theme = test_theme.with_tweaks([tweaks["panel_no_pill"], tweaks["launchpad"]])
+        self.assertEqual(tweaked_theme.variant_name('mocha', 'blue'), "mocha-blue-no-pill+launchpad")
+
+        # the same theme with tweaks added as text
+        expected_theme = Theme("gnome-shell", colors,
+                               f"{project_folder}/{config.raw_theme_folder}/{config.gnome_folder}",
+                               themes_folder)
+        expected_theme += tweaks["panel_no_pill"].styles
+        expected_theme += tweaks["launchpad"].styles
+        expected_theme *= f"{project_folder}/{config.tweaks_folder}/launchpad/launchpad.png"
+
+        self.assertEqual(tweaked_theme.render('mocha', 'blue'), expected_theme.render('mocha', 'blue'))
+        self.assertNotIn("launchpad.png", test_theme.files)
+
+        tweaked_theme.install('mocha', 'blue')
+        self.assertTrue(os.path.isfile(
+            f"{themes_folder}/Marble-mocha-blue-no-pill+launchpad-/{config.gnome_folder}/launchpad.png"))
+
+        shutil.rmtree(tests_folder)
+
+
+class TestRender(unittest.TestCase):
+
+    def test_render(self):
+        """
+        Test if themes are rendered in memory from several threads like installed themes
+        """
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with open(f"{project_folder}/{config.colors_json}") as colors_json:
+            colors = json.load(colors_json)
+
+        test_theme = Theme("gnome-shell", colors,
+                           f"{project_folder}/{config.raw_theme_folder}/{config.gnome_folder}", tests_folder)
+        test_theme.apply_tweak(load_tweaks(f"{project_folder}/{config.tweaks_json}")["launchpad"])
+        expected = test_theme.render('mocha', 'blue')
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: render('mocha', 'blue', ["launchpad"]), range(8)))
+
+        for rendered in results:
+            self.assertEqual(rendered, expected)
+
+        self.assertFalse(os.path.exists(tests_folder))
+        self.assertRaises(ValueError, render, 'mocha', 'blue', ["unknown"])
+
+
+class TestServe(unittest.TestCase):
+
+    def test_serve(self):
+        """
+        Test if concurrent requests render a variant once and ETag skips rendering
+        """
+
+        import asyncio
+
+        server = ThemeServer(0)
+        calls = list()
+        rendered = server.rendered
+
+        async def counted(key, function):
+            def counted_function():
+                calls.append(key)
+                return function()
+
+            return await rendered(key, counted_function)
+
+        server.rendered = counted
+
+        async def request(path, headers=""):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n{headers}\r\n".encode())
+            response = await reader.read()
+            writer.close()
+
+            head, _, body = response.partition(b"\r\n\r\n")
+            lines = head.decode().split("\r\n")
+            headers = dict(line.split(": ", 1) for line in lines[1:])
+            return int(lines[0].split(" ")[1]), headers, body
+
+        async def run():
+            nonlocal port
+            tcp_server = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+            port = tcp_server.sockets[0].getsockname()[1]
+
+            async with tcp_server:
+                responses = await asyncio.gather(*(request("/mocha/blue/gnome-shell.css?tweaks=launchpad")
+                                                   for _ in range(4)))
+                etag = responses[0][1]["ETag"]
+                not_modified = await request("/mocha/blue/gnome-shell.css?tweaks=launchpad",
+                                             f"If-None-Match: {etag}\r\n")
+                missing = await request("/mocha/unknown/gnome-shell.css")
+
+            return responses, not_modified, missing
+
+        port = None
+        with contextlib.redirect_stdout(io.StringIO()):
+            responses, not_modified, missing = asyncio.run(run())
+
+        expected = render('mocha', 'blue', ["launchpad"])["gnome-shell.css"]
+        for status, headers, body in responses:
+            self.assertEqual((status, body), (200, expected))
+
+        self.assertEqual(len(server.cache.entries), 1)
+        self.assertEqual(not_modified[0], 304)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(missing[0], 404)
+
+    def test_render_cache(self):
+        """
+        Test if least recently used values are evicted by size
+        """
+
+        cache = RenderCache(10)
+        cache.put("a", "a", 4)
+        cache.put("b", "b", 4)
+        cache.get("a")
+        cache.put("c", "c", 4)
+
+        self.assertEqual(list(cache.entries), ["a", "c"])
+        self.assertEqual(cache.size, 8)
+
+
+class TestWatch(unittest.TestCase):
+
+    def test_update_partial(self):
+        """
+        Test if changed partial is applied to main styles in memory, tweaks are kept
+        """
+
+        theme_folder = f"{tests_folder}/theme/{config.gnome_folder}"
+        shutil.copytree(f"{project_folder}/{config.raw_theme_folder}/{config.gnome_folder}_css", f"{theme_folder}_css")
+        shutil.copytree(f"{project_folder}/{config.raw_theme_folder}/{config.gnome_folder}", theme_folder)
+
+        with open(f"{project_folder}/{config.colors_json}") as colors_json:
+            colors = json.load(colors_json)
+
+        def create_theme():
+            theme = Theme("gnome-shell", colors, theme_folder, f"{tests_folder}/.themes")
+            theme += "/* tweak */"
+            return theme
+
+        watcher = ThemeWatcher(create_theme, (("mocha", "blue"),), (f"{tests_folder}/theme",))
+        watcher.load()
+
+        with open(f"{theme_folder}_css/panel.css", "a") as f:
+            f.write("#panel { color: @accent-color; }")
+
+        with mock.patch("scripts.watch.generate_file") as reload_styles:
+            watcher.update([f"{theme_folder}_css/panel.css"])
+            reload_styles.assert_not_called()
+
+        generate_file.cache_clear()
+        self.assertEqual(watcher.theme.styles, generate_file(f"{theme_folder}_css/") + "\n/* tweak */")
+        self.assertIn("#panel { color: #89b4fa; }", watcher.theme.render("mocha", "blue")["gnome-shell.css"].decode())
+
+        shutil.rmtree(tests_folder)
+
+
+class TestTemplate(unittest.TestCase):
+
+    def test_longest_keyword(self):
+        """
+        Test if keywords that are prefixes of other keywords don't break them
+        """
+
+        template = Template("a { color: @accent-color; } a:hover { color: @accent-color-hover; }",
+                            ("@accent-color", "@accent-color-hover"))
+
+        rendered = template.render({"@accent-color": "#111111", "@accent-color-hover": "#222222"})
+        self.assertEqual(rendered, "a { color: #111111; } a:hover { color: #222222; }")
+
+    def test_unknown_keyword(self):
+        """
+        Test if keywords without values are left untouched
+        """
+
+        template = Template("@text @base", ("@text", "@base"))
+        self.assertEqual(template.render({"@text": "#ffffff"}), "#ffffff @base")
+
+    def test_rendered_size(self):
+        """
+        Test if size is counted like the size of rendered text
+        """
+
+        template = Template.join([Template("a { color: @text; } /* ✓ */", ("@text",)), Template("@base", ("@base",))])
+        values = {"@text": "rgba(0, 0, 0, 0.5)"}
+        self.assertEqual(template.rendered_size(values), len(template.render(values).encode()))
+
+
+class TestCss(unittest.TestCase):
+
+    def test_drop_properties(self):
+        """
+        Test if only exact properties are removed, also from multi-line declarations
+        """
+
+        content = ("#panel { background-color: red; color: blue;\n"
+                   "  box-shadow: 0 0 1px black,\n    0 0 2px white; }\n"
+                   ".label { border-color: @text; color: white !important; }\n")
+
+        stylesheet = parse(content, drop_important, drop_properties("color", "box-shadow"))
+        self.assertEqual(serialize(stylesheet), "#panel {\n"
+                                                "    background-color: red;\n"
+                                                "}\n"
+                                                ".label {\n"
+                                                "    border-color: @text;\n"
+                                                "}\n")
+
+    def test_serialize_stable(self):
+        """
+        Test if parsed stylesheet is serialized the same way twice
+        """
+
+        content = ("/* header */\n@import url(\"a.css\");\n"
+                   "@media (max-width: 10px) { a, /* comment */ b { content: \"{;}\"; } }\n")
+
+        serialized = serialize(parse(content))
+        self.assertEqual(serialize(parse(serialized)), serialized)
+        self.assertIn('content: "{;}";', serialized)
+
+    def test_minify(self):
+        """
+        Test if overridden declarations are folded and duplicate rules are merged
+        """
+
+        content = ("/* panel */\n#panel { color: red !important; color: blue; padding: 0 2px; }\n"
+                   ".button { spacing: 4px; }\n"
+                   "/* marker */\n"
+                   "#panel { padding: 4px; font: \"Cantarell,  Sans\"; }\n"
+                   ".label { box-shadow: 0 0 1px rgba(0, 0, 0, 0.5); }\n"
+                   ".title, .subtitle { box-shadow: 0 0 1px rgba(0, 0, 0, 0.5); }\n"
+                   ".icon:not(.dot) { box-shadow: 0 0 1px rgba(0, 0, 0, 0.5); }\n")
+
+        minified = minify(content, ("/* marker */",))
+        self.assertEqual(minified, "#panel{color:red!important}.button{spacing:4px}\n/* marker */\n"
+                                   "#panel{padding:4px;font:\"Cantarell,  Sans\"}"
+                                   ".label,.title,.subtitle{box-shadow:0 0 1px rgba(0,0,0,0.5)}"
+                                   ".icon:not(.dot){box-shadow:0 0 1px rgba(0,0,0,0.5)}")
+        self.assertEqual(minify(minified, ("/* marker */",)), minified)
+
+    def test_unquoted_url(self):
+        """
+        Test if unquoted url() with ; / and spaces is kept as a single value
+        """
+
+        url = "url(data:image/svg+xml;utf8,<svg xmlns='a'>/*x*/</svg>, x)"
+        content = f".check {{ background-image: {url}; color: red; }}\n"
+
+        stylesheet = parse(content)
+        self.assertEqual(serialize(stylesheet), ".check {\n"
+                                                f"    background-image: {url};\n"
+                                                "    color: red;\n"
+                                                "}\n")
+        self.assertEqual(minify(content), f".check{{background-image:{url};color:red}}")
+        self.assertEqual(parse("a { b: URL( x.png ) }").children[0].children[0].value, "URL( x.png )")
+
+    def test_prune_selectors(self):
+        """
+        Test if plain selectors with unknown classes are removed, and rules without selectors are dropped
+        """
+
+        inventory = selector_inventory("#panel .clock, .workspace-dot { color: red; }\n"
+                                       "StEntry[title=\".hint\"]:focus { color: blue; }")
+        self.assertEqual(inventory, {"#panel", ".clock", ".workspace-dot"})
+
+        pruned = list()
+        stylesheet = parse("#panel .workspace-dot, .workspace-indicator { color: red; }\n"
+                           ".workspace-indicator .dot { color: blue; }\n"
+                           "StLabel:hover, #panel { color: white; }\n"
+                           ".clock:not(.hint, .dot), .dot[title=\"a, b\"] { color: green; }\n",
+                           prune_selectors(inventory, pruned))
+
+        self.assertEqual(serialize(stylesheet), "#panel .workspace-dot {\n"
+                                                "    color: red;\n"
+                                                "}\n"
+                                                "StLabel:hover, #panel {\n"
+                                                "    color: white;\n"
+                                                "}\n"
+                                                ".clock:not(.hint, .dot), .dot[title=\"a, b\"] {\n"
+                                                "    color: green;\n"
+                                                "}\n")
+        self.assertEqual(pruned, [".workspace-indicator", ".workspace-indicator .dot"])
+
+
+class TestPalette(unittest.TestCase):
+
+    def test_derived_colors(self):
+        """
+        Test if derived colors from colors.json are computed for a variant
+        """
+
+        with open(f"{project_folder}/{config.colors_json}") as colors_json:
+            colors = json.load(colors_json)
+
+        palette = Palette(colors)
+        variant_colors = palette.colors("mocha", "blue")
+
+        self.assertEqual(variant_colors["@accent-color"], colors["@mocha"]["@blue"])
+        for keyword in colors["derived"]:
+            self.assertIn(keyword, variant_colors)
+            self.assertIn(keyword, palette.keywords)
+
+        self.assertEqual(variant_colors["@accent-color-hover"], adjust_lightness(colors["@mocha"]["@blue"], 1.1))
+
+    def test_palette_index(self):
+        """
+        Test if every flavor has colors of every accent
+        """
+
+        flavors, accents = palette_index(f"{project_folder}/{config.colors_json}")
+        self.assertIn("mocha", flavors)
+        self.assertIn("blue", accents)
+
+        with open(f"{project_folder}/{config.colors_json}") as colors_json:
+            colors = json.load(colors_json)
+
+        for flavor in flavors:
+            self.assertFalse(set("@" + accent for accent in accents) - set(colors["@" + flavor]), msg=flavor)
+
+    def test_batch_lightness(self):
+        """
+        Test if colors computed in one pass are the same as computed one by one
+        """
+
+        hex_colors = ["#000000", "#ffffff", "#808080", "#ff0000", "#89b4fa", "#d20f39", "#40a02b"]
+        hex_colors += ["#%06x" % (index * 0x10a3f1 % 0x1000000) for index in range(100)]  # enough for NumPy
+
+        for factor in (0.5, 0.9, 1.1, 2):
+            self.assertEqual(adjust_lightness_batch(hex_colors, factor),
+                             [adjust_lightness(hex_color, factor) for hex_color in hex_colors])
+
+    def test_custom_accents(self):
+        """
+        Test if custom accents from a file are computed with derived colors for every flavor
+        """
+
+        os.makedirs(tests_folder, exist_ok=True)
+        with open(f"{tests_folder}/accents.csv", "w") as f:
+            f.write("name,hex\n" + "".join(f"team{index},#{index * 0x10a3f1 % 0x1000000:06X}\n"
+                                           for index in range(100)))
+
+        accents = load_accents(f"{tests_folder}/accents.csv")
+        shutil.rmtree(tests_folder)
+        self.assertEqual(accents["team1"], "#10a3f1")
+
+        with open(f"{project_folder}/{config.colors_json}") as colors_json:
+            palette = Palette(json.load(colors_json))
+
+        for name, color in accents.items():
+            palette.add_accent(name, color)
+
+        variants = [("mocha", name) for name in accents] + [("latte", "team1"), ("latte", "blue")]
+        palette.precompute(variants)
+
+        self.assertEqual(palette.colors("latte", "team1")["@accent-color"], "#10a3f1")
+        self.assertEqual(palette.colors("mocha", "team1")["@accent-color-hover"], adjust_lightness("#10a3f1", 1.1))
+        self.assertRaises(ValueError, palette.add_accent, "blue", "#10a3f1")
+        self.assertRaises(ValueError, palette.add_accent, "brand", "#10a3f")
+        self.assertRaises(ValueError, palette.add_accent, "brand", "+12345")
+        self.assertRaises(ValueError, palette.add_accent, "text", "#10a3f1")
+
+    def test_malformed_accents(self):
+        """
+        Test if malformed accent files are reported with file name and row
+        """
+
+        os.makedirs(tests_folder, exist_ok=True)
+        files = {"accents.csv": "name,hex\nbrand,#10a3f1\nteam\n",
+                 "accents.json": '{"brand": 1}',
+                 "list.json": '[{"name": "brand"}]'}
+
+        try:
+            for file, content in files.items():
+                with open(f"{tests_folder}/{file}", "w") as f:
+                    f.write(content)
+
+                with self.assertRaisesRegex(ValueError, file):
+                    load_accents(f"{tests_folder}/{file}")
+        finally:
+            shutil.rmtree(tests_folder)
+
+
+class TestFileOps(unittest.TestCase):
+
+    def test_copy_file(self):
+        """
+        Test if file is copied with its content and permissions, including paths with spaces
+        """
+
+        source = f"{tests_folder}/source folder"
+        destination = f"{tests_folder}/destination folder"
+
+        os.makedirs(source)
+        os.makedirs(destination)
+        with open(f"{source}/file name.css", "w") as f:
+            f.write("#panel { color: red; }" * 10000)
+        os.chmod(f"{source}/file name.css", 0o600)
+
+        copy_file(f"{source}/file name.css", f"{destination}/file name.css")
+
+        with open(f"{destination}/file name.css") as f:
+            self.assertEqual(f.read(), "#panel { color: red; }" * 10000)
+        self.assertEqual(os.stat(f"{destination}/file name.css").st_mode & 0o777, 0o600)
+
+        remove_folder(tests_folder)
+        self.assertFalse(os.path.exists(tests_folder))
+
+
+class TestGResource(unittest.TestCase):
+
+    @unittest.skipUnless(shutil.which("glib-compile-resources"), "glib-compile-resources is not installed")
+    def test_read_gresource(self):
+        """
+        Test if resources compiled by glib-compile-resources are read correctly
+        """
+
+        theme_folder = f"{project_folder}/{config.raw_theme_folder}/{config.gnome_folder}"
+        os.makedirs(tests_folder, exist_ok=True)
+
+        files = sorted(os.listdir(theme_folder))
+        compressed = files[0]
+        xml = "".join(f'<file compressed="{str(file == compressed).lower()}">{file}</file>' for file in files)
+
+        with open(f"{tests_folder}/test.gresource.xml", "w") as f:
+            f.write(f'<?xml version="1.0" encoding="UTF-8"?><gresources>'
+                    f'<gresource prefix="/org/gnome/shell/theme">{xml}</gresource></gresources>')
+
+        subprocess.run(["glib-compile-resources", f"--sourcedir={theme_folder}",
+                        f"--target={tests_folder}/test.gresource", f"{tests_folder}/test.gresource.xml"], check=True)
+
+        resources = read_gresource(f"{tests_folder}/test.gresource")
+
+        self.assertEqual(len(resources), len(files))
+        for file in files:
+            with open(f"{theme_folder}/{file}", "rb") as f:
+                self.assertEqual(resources[f"/org/gnome/shell/theme/{file}"], f.read())
+
+        shutil.rmtree(tests_folder)
+
+    def test_build_gresource(self):
+        """
+        Test if compiled resources are read back the same
+        """
+
+        resources = {
+            "/org/gnome/shell/theme/gnome-shell.css": b"#panel { color: red; }",
+            "/org/gnome/shell/theme/icons/scalable/actions/icon.svg": b"<svg/>",
+            "/org/gnome/shell/theme/empty.css": b"",
+            "/org/gnome/shell/theme/unicode-\u00fc.css": "\u00fc".encode(),
+        }
+        resources.update({f"/org/gnome/shell/theme/file-{i}.svg": bytes(range(i)) for i in range(40)})
+
+        bundle = build_gresource(resources, compressed={"/org/gnome/shell/theme/gnome-shell.css"})
+        self.assertEqual(parse_gresource(bundle), resources)
+
+    def test_build_gresource_fixture(self):
+        """
+        Test if compiled resources are byte-for-byte the same as a known bundle, items are in GHashTable order
+        """
+
+        resources = {f"/org/gnome/shell/theme/{'icons/' if i % 3 == 0 else ''}file-{i}.svg": f'<svg id="{i}"/>'.encode()
+                     for i in range(24)}
+        resources["/org/gnome/shell/theme/gnome-shell.css"] = b"#panel { color: red; }\n"
+
+        with open(f"{project_folder}/{config.scripts_folder}/fixtures/theme.gresource", "rb") as f:
+            self.assertEqual(build_gresource(resources), f.read())
+
+    @unittest.skipUnless(shutil.which("gresource"), "gresource is not installed")
+    def test_build_gresource_glib(self):
+        """
+        Test if GLib can find and extract compiled resources
+        """
+
+        theme_folder = f"{project_folder}/{config.raw_theme_folder}/{config.gnome_folder}"
+        os.makedirs(tests_folder, exist_ok=True)
+
+        resources = dict()
+        for file in os.listdir(theme_folder):
+            with open(f"{theme_folder}/{file}", "rb") as f:
+                resources[f"/org/gnome/shell/theme/{file}"] = f.read()
+
+        with open(f"{tests_folder}/test.gresource", "wb") as f:
+            f.write(build_gresource(resources, compressed=set(list(resources)[:3])))
+
+        listed = subprocess.run(["gresource", "list", f"{tests_folder}/test.gresource"],
+                                capture_output=True, text=True, check=True).stdout.split()
+        self.assertEqual(sorted(listed), sorted(resources))
+
+        for resource, content in resources.items():
+            extracted = subprocess.run(["gresource", "extract", f"{tests_folder}/test.gresource", resource],
+                                       capture_output=True, check=True).stdout
+            self.assertEqual(extracted, content, msg=f"{resource} differs")
+
+        shutil.rmtree(tests_folder)
+
+    @unittest.skipUnless(shutil.which("glib-compile-resources"), "glib-compile-resources is not installed")
+    def test_build_gresource_identical(self):
+        """
+        Test if compiled resources are byte-for-byte the same as from glib-compile-resources
+        """
+
+        theme_folder = f"{project_folder}/{config.raw_theme_folder}/{config.gnome_folder}"
+        os.makedirs(tests_folder, exist_ok=True)
+
+        files = sorted(os.listdir(theme_folder))
+        xml = "".join(f"<file>{file}</file>" for file in files)
+
+        with open(f"{tests_folder}/test.gresource.xml", "w") as f:
+            f.write(f'<?xml version="1.0" encoding="UTF-8"?><gresources>'
+                    f'<gresource prefix="/org/gnome/shell/theme">{xml}</gresource></gresources>')
+
+        subprocess.run(["glib-compile-resources", f"--sourcedir={theme_folder}",
+                        f"--target={tests_folder}/test.gresource", f"{tests_folder}/test.gresource.xml"], check=True)
+
+        resources = dict()
+        for file in files:
+            with open(f"{theme_folder}/{file}", "rb") as f:
+                resources[f"/org/gnome/shell/theme/{file}"] = f.read()
+
+        with open(f"{tests_folder}/test.gresource", "rb") as f:
+            self.assertEqual(build_gresource(resources), f.read())
+
+        shutil.rmtree(tests_folder)
+
+
+class TestGlobalTheme(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Create gnome-shell-theme.gresource with default gnome styles
+        """
+
+        self.gresource_folder = f"{tests_folder}/gnome-shell"
+        os.makedirs(self.gresource_folder, exist_ok=True)
+
+        gnome_styles = b"#panel {\n  background-color: black !important;\n  font-size: 12px; }\n"
+        with open(f"{self.gresource_folder}/{config.gnome_shell_gresource}", "wb") as f:
+            f.write(build_gresource({
+                "/org/gnome/shell/theme/gnome-shell-light.css": gnome_styles,
+                "/org/gnome/shell/theme/gnome-shell-dark.css": gnome_styles,
+                "/org/gnome/shell/theme/pad-osd.css": b".pad-osd { }\n",
+            }))
+
+        with open(f"{project_folder}/{config.colors_json}") as colors_json:
+            self.colors = json.load(colors_json)
+
+        self.environment = mock.patch.dict(os.environ, {"XDG_CACHE_HOME": f"{tests_folder}/.cache"})
+        self.environment.start()
+
+    def tearDown(self):
+        self.environment.stop()
+        shutil.rmtree(tests_folder)
+
+    def install(self, minify=False):
+        """
+        Install GDM theme to the test gresource
+        :param minify: if True, theme styles are minified
+        :return: installed resources
+        """
+
+        gdm_theme = GlobalTheme(self.colors, f"{project_folder}/{config.raw_theme_folder}/{config.gnome_folder}",
+                                self.gresource_folder, config.gnome_shell_gresource, f"{tests_folder}/.temp",
+                                minify=minify)
+        gdm_theme.install("mocha", "blue")
+        del gdm_theme
+
+        return read_gresource(f"{self.gresource_folder}/{config.gnome_shell_gresource}")
+
+    def test_install_gdm(self):
+        """
+        Test if GDM theme is installed over gnome styles, and reinstalled from cache
+        """
+
+        resources = self.install()
+
+        dark_styles = resources["/org/gnome/shell/theme/gnome-shell-dark.css"].decode()
+        self.assertIn("font-size: 12px", dark_styles)
+        self.assertNotIn("!important;\n  font-size", dark_styles)
+        self.assertIn(self.colors["@mocha"]["@blue"], dark_styles)
+        self.assertIn("toggle-on-light.svg", resources["/org/gnome/shell/theme/gnome-shell-light.css"].decode())
+        self.assertIn("/org/gnome/shell/theme/pad-osd.css", resources)
+
+        self.assertTrue(os.path.exists(f"{self.gresource_folder}/{config.gnome_shell_gresource}.backup"))
+        self.assertEqual(len(os.listdir(f"{tests_folder}/.cache/{config.cache_folder}/gdm")), 1)
+
+        # reinstall uses backup and cached gnome styles
+        self.assertEqual(self.install(), resources)
+
+    def test_install_gdm_current(self):
+        """
+        Test if the same theme is not copied again
+        """
+
+        resources = self.install()
+        gresource_file = f"{self.gresource_folder}/{config.gnome_shell_gresource}"
+        modified = os.stat(gresource_file).st_mtime_ns
+
+        gdm_theme = GlobalTheme(self.colors, f"{project_folder}/{config.raw_theme_folder}/{config.gnome_folder}",
+                                self.gresource_folder, config.gnome_shell_gresource, f"{tests_folder}/.temp")
+        output = io.StringIO()
+        with mock.patch("scripts.gdm.copy_privileged") as copy_privileged, contextlib.redirect_stdout(output):
+            self.assertEqual(gdm_theme.install("mocha", "blue"), current_status)
+            copy_privileged.assert_not_called()
+        self.assertNotIn("Reinstalling", output.getvalue())
+        del gdm_theme
+
+        self.assertEqual(os.stat(gresource_file).st_mtime_ns, modified)
+
+        # other accent is installed
+        gdm_theme = GlobalTheme(self.colors, f"{project_folder}/{config.raw_theme_folder}/{config.gnome_folder}",
+                                self.gresource_folder, config.gnome_shell_gresource, f"{tests_folder}/.temp")
+        self.assertEqual(gdm_theme.install("mocha", "red"), 0)
+        del gdm_theme
+
+        self.assertNotEqual(read_gresource(gresource_file), resources)
+
+    def test_upstream_inventory(self):
+        """
+        Test if selectors are collected from default gnome styles, also when theme is installed
+        """
+
+        gresource_file = f"{self.gresource_folder}/{config.gnome_shell_gresource}"
+        self.assertEqual(upstream_inventory(gresource_file), {"#panel", ".pad-osd", *kept_names})
+
+        self.install()
+        self.assertEqual(upstream_inventory(gresource_file), {"#panel", ".pad-osd", *kept_names})
+
+    def test_corrupt_cache(self):
+        """
+        Test if corrupt cache of default gnome styles is extracted and saved again
+        """
+
+        resources = self.install()
+
+        cache = f"{tests_folder}/.cache/{config.cache_folder}/gdm"
+        cached_theme = f"{cache}/{os.listdir(cache)[0]}"
+        with open(cached_theme, "r+b") as f:
+            f.truncate(os.path.getsize(cached_theme) // 2)
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.assertEqual(self.install(), resources)
+        self.assertIn("Cached gresource files are corrupt.", output.getvalue())
+
+        with open(cached_theme, "rb") as f:
+            self.assertEqual(len(parse_gresource(f.read())), 3)
+        self.assertRaises(ValueError, parse_gresource, b"GVariant" + bytes(8))
+
+    def test_prune_extensions(self):
+        """
+        Test if styles for extensions are kept when unused selectors are pruned
+        """
+
+        gnome_styles = b"#dash .dash-background, .app-well-app .app-well-app-running-dot { color: red; }\n"
+        with open(f"{self.gresource_folder}/{config.gnome_shell_gresource}", "wb") as f:
+            f.write(build_gresource({"/org/gnome/shell/theme/gnome-shell-light.css": gnome_styles,
+                                     "/org/gnome/shell/theme/gnome-shell-dark.css": gnome_styles}))
+
+        gdm_theme = GlobalTheme(self.colors, f"{project_folder}/{config.raw_theme_folder}/{config.gnome_folder}",
+                                self.gresource_folder, config.gnome_shell_gresource, f"{tests_folder}/.temp",
+                                prune=True)
+        self.assertEqual(gdm_theme.install("mocha", "blue"), 0)
+        del gdm_theme
+
+        gresource_file = f"{self.gresource_folder}/{config.gnome_shell_gresource}"
+        dark_styles = read_gresource(gresource_file)["/org/gnome/shell/theme/gnome-shell-dark.css"].decode()
+        self.assertIn("#dashtodockContainer #dash .dash-background", dark_styles)
+        self.assertIn("#dashtodockContainer .app-well-app.focused .app-well-app-running-dot", dark_styles)
+        self.assertNotIn(".world-clocks-button", dark_styles)
+
+    def test_install_gdm_minified(self):
+        """
+        Test if minified GDM theme is smaller and still detected as installed
+        """
+
+        resources = self.install()
+        minified = self.install(minify=True)
+
+        dark_styles = minified["/org/gnome/shell/theme/gnome-shell-dark.css"]
+        self.assertLess(len(dark_styles), len(resources["/org/gnome/shell/theme/gnome-shell-dark.css"]))
+        self.assertIn(b"\n/* Marble theme */\n", dark_styles)
+        self.assertNotIn(b"\n    ", dark_styles)
+
+        # default theme is backed up once, minified theme is reinstalled from backup
+        self.assertEqual(self.install(), resources)
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_compare(self):
+        """
+        Test if stages slower than baseline are reported as regressions
+        """
+
+        baseline = {"render": {"min": 0.010}, "write": {"min": 0.020}}
+        results = {"render": {"min": 0.020}, "write": {"min": 0.021}, "gdm": {"min": 0.5}}
+
+        ratios, regressions = compare(results, baseline, 1.5)
+        self.assertEqual(ratios, {"render": 2.0, "write": 1.05})
+        self.assertEqual(regressions, ["render"])
+
+
+class TestProfiler(unittest.TestCase):
+
+    def test_instrument(self):
+        """
+        Test if calls of instrumented methods are counted, also private ones
+        """
+
+        class Stages:
+            def run(self):
+                self.__prepare()
+                return "result"
+
+            def __prepare(self):
+                pass
+
+        profiler = Profiler()
+        profiler.instrument(Stages, "run", "Stages.run")
+        profiler.instrument(Stages, "_Stages__prepare", "Stages.__prepare")
+
+        profiler.start()
+        self.assertEqual(Stages().run(), "result")
+        Stages().run()
+        profiler.stop()
+
+        report = profiler.report()
+        self.assertEqual(list(report["stages"]), ["Stages.run", "Stages.__prepare"])
+        self.assertEqual(report["stages"]["Stages.__prepare"]["calls"], 2)
+        self.assertLessEqual(report["stages"]["Stages.run"]["seconds"], report["total"])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,36 +1,69 @@
 import os
-import shutil
-import colorsys  # colorsys.hls_to_rgb(h, l, s)
+import copy
+import hashlib
 
+from . import config  # name of folders and files
+from .template import Template, compile_template  # precompiled css/svg files
+from .palette import Palette    # flavor, accent and derived colors
+from .css import minify, parse, serialize, prune_selectors  # compact and prune main styles
 from .utils import (
-    replace_keywords,    # replace keywords in file
-    copy_files,          # copy files from source to destination
+    read_files,          # load files from folder to memory
+    write_files,         # write files from memory to folder
+    link_files,          # hardlink files from shared store
+    remove_stale_files,  # delete files that are no longer generated
+    clean_store,         # delete shared files that are not used
     destination_return,  # copied/modified theme location
     generate_file)       # combine files from folder to one file
+from .fileops import (
+    remove_folder,         # delete folder
+    staging_folder,        # create folder that replaces installed one
+    sync_files,            # flush written files to disk
+    replace_folder,        # swap staged folder with installed one
+    remove_in_background)  # delete replaced folder without waiting
+from .manifest import (
+    files_digest,        # digest of theme files
+    variant_digest,      # digest of all variant inputs
+    is_up_to_date,       # check if installed variant can be skipped
+    referenced_files,    # shared files used by installed variants
+    manifest_files,      # files of the previous build
+    write_manifest)      # save digest of installed variant
 
 
 class Theme:
-    def __init__(self, theme_type, colors_json, theme_folder, destination_folder, temp_folder, is_filled=False):
+    def __init__(self, theme_type, colors_json, theme_folder, destination_folder, is_filled=False):
         """
         Initialize Theme class
         :param colors_json: location of a json file with colors
         :param theme_type: theme type (gnome-shell, gtk, etc.)
         :param theme_folder: raw theme location
         :param destination_folder: folder where themes will be installed
-        :param temp_folder: folder where files will be collected
         :param is_filled: if True, theme will be filled
         """
 
         self.colors = colors_json
-        self.temp_folder = f"{temp_folder}/{theme_type}"
         self.theme_folder = theme_folder
         self.theme_type = theme_type
         self.destination_folder = destination_folder
-        self.main_styles = f"{self.temp_folder}/{theme_type}.css"
+        self.main_styles = f"{theme_type}.css"
+        self.templates = None  # compiled on the first install
+        self.sources_digest = None  # digest of files, computed with templates
+        self.static_files = None  # {file name: digest} of files without colors, computed with templates
+        self.store_folder = f"{destination_folder}/{config.store_folder}"
+        self.tweaks = list()  # names of applied tweaks
+        self.fragments = list()  # Tweak objects, their styles are added to compiled main styles
+        self.suffix = ""  # added to variant names of tweak-matrix themes
+        self.minify = False  # if True, main styles are minified
+        self.markers = list()  # comments that are kept in minified styles
+        self.styles_template = None  # main styles before minification, used for size report
 
-        # move files to temp folder
-        copy_files(self.theme_folder, self.temp_folder)
-        generate_file(f"{self.theme_folder}_css/", self.main_styles)
+        self.files_cache = dict()  # {file name: (content, Template or digest)}, shared with copies made by with_tweaks
+
+        self.palette = Palette(self.colors)
+        self.keywords = frozenset(self.palette.keywords)  # every keyword that may be replaced in theme files
+
+        # load files to memory, they are read from disk once per process
+        self.files = dict(read_files(self.theme_folder))
+        self.styles = generate_file(f"{self.theme_folder}_css/")
 
         # if theme is filled
         
@@ -52,95 +85,391 @@ class Theme:
         :return: new Theme object
         """
 
-        with open(self.main_styles, 'a') as main_styles:
-            main_styles.write('\n' + other)
+        self.styles += '\n' + other
+
+        self.templates = None
         return self
 
     def __mul__(self, other):
         """
-        Copy files to temp folder
+        Add files to the theme
         :param other: file or folder
         :return: new Theme object
         """
 
         if os.path.isfile(other):
-            shutil.copy(other, self.temp_folder)
+            with open(other, 'rb') as read_file:
+                self.files[os.path.basename(other)] = read_file.read()
         else:
-            shutil.copytree(other, self.temp_folder)
+            self.files.update(read_files(other))
 
+        self.templates = None
         return self
 
-    def __del__(self):
-        # delete temp folder
-        os.system(f"rm -r {self.temp_folder}")
-        
-    def adjust_lightness(self, hexColor, factor=1.1):
-        r, g, b = float(int(hexColor[1:3], 16)), float(int(hexColor[3:5], 16)), float(int(hexColor[5:], 16))
-        print(r, g, b)
-        h, l, s = colorsys.rgb_to_hls(r / 255.0, g / 255.0, b / 255.0)
-        l = max(min(l * factor, 1.0), 0.0)
-        r, g, b = colorsys.hls_to_rgb(h, l, s)
-        r, g, b = int(r * 255), int(g * 255), int(b * 255)
-        return "#%02x%02x%02x" % (r,g,b)
-
-    def __apply_colors(self, destination, apply_file, flavor, accent):
-        """
-        Install accent colors from colors.json to different file
-        :param hue
-        :param destination: file directory
+    def __compile_templates(self):
+        """
+        Split css/svg files into templates once for all variants
+        :return: {file name: Template}
+        """
+
+        if self.templates is None:
+            styles = self.styles + "".join('\n' + tweak.styles for tweak in self.fragments)
+
+            # styles are minified once with keywords, colors don't change the structure
+            if self.minify:
+                self.styles_template = compile_template(styles, self.keywords)
+                styles = minify(styles, self.markers)
+                main_template = compile_template(styles, self.keywords)
+
+            else:
+                # main styles are compiled once per process for every tweak combination
+                main_template = Template.join([compile_template(self.styles, self.keywords),
+                                               *(tweak.template(self.keywords) for tweak in self.fragments)])
+
+            self.templates = {self.main_styles: main_template}
+            self.static_files = dict()
+
+            for apply_file, content in self.files.items():
+                cached = self.files_cache.get(apply_file)
+                if cached is None or cached[0] is not content:
+                    cached = self.files_cache[apply_file] = (content, self.__compile_file(apply_file, content))
+
+                if isinstance(cached[1], Template):
+                    self.templates[apply_file] = cached[1]
+                else:
+                    self.static_files[apply_file] = cached[1]
+
+            self.sources_digest = files_digest({**self.files, self.main_styles: styles})
+
+        return self.templates
+
+    def compile(self):
+        """
+        Compile templates now. Compiled theme is only read while rendering,
+        so it can be rendered from several threads.
+        :return: Theme object
+        """
+
+        self.__compile_templates()
+        return self
+
+    def __compile_file(self, apply_file, content):
+        """
+        Split file into template if it has colors
         :param apply_file: file name
-        :param sat: color saturation (optional)
+        :param content: file content
+        :return: Template object, or digest of a file without colors
         """
-        colors = self.colors["@" + flavor]
-        # list of (keyword, replaced value)
-        replaced_colors = list()
-        
-        replaced_colors.append(("@accent-color", colors["@" + accent]))
-        replaced_colors.append(("@accent-color-hover", self.adjust_lightness(colors["@"+ accent])))
-        
-        for keyword in colors:
-            replaced_colors.append((keyword, colors[keyword]))
 
-        # replace colors
-        replace_keywords(os.path.expanduser(f"{destination}/{apply_file}"), *replaced_colors)
+        # binary files and files without colors are the same in every variant
+        if apply_file.lower().endswith(('.css', '.scss', '.svg')):
+            template = Template(content.decode(), self.keywords)
+
+            if template.slots:
+                return template
+
+        return hashlib.sha256(content).hexdigest()
+
+    def __apply_colors(self, flavor, accent):
+        """
+        Collect accent colors from colors.json
+        :param flavor: flavor name
+        :param accent: accent color name
+        :return: {keyword: replaced value}
+        """
+
+        return self.palette.colors(flavor, accent)
+
+    def __digest(self, flavor, replaced_colors):
+        """
+        Digest of variant inputs for build manifest
+        :param flavor: flavor name
+        :param replaced_colors: {keyword: replaced value}
+        :return: hex digest
+        """
+
+        self.__compile_templates()
+        return variant_digest(self.sources_digest, self.palette.flavors["@" + flavor], replaced_colors,
+                              self.tweaks)
+
+    def variant_name(self, flavor, accent):
+        """
+        Name of installed variant
+        :param flavor: flavor name
+        :param accent: accent color name
+        :return: name (mocha-blue, or mocha-blue-def-size+no-pill for tweak-matrix themes)
+        """
+
+        return f"{flavor}-{accent}{self.suffix}"
+
+    def digest(self, flavor, accent):
+        """
+        Digest of variant inputs, the same as in build manifest
+        :param flavor: flavor name
+        :param accent: accent color name
+        :return: hex digest
+        """
+
+        return self.__digest(flavor, self.__apply_colors(flavor, accent))
+
+    def __size_report(self, replaced_colors):
+        """
+        Size of main styles before and after minification, counted without rendering them
+        :param replaced_colors: {keyword: replaced value}
+        :return: report text or empty string
+        """
+
+        if not self.minify:
+            return ""
+
+        before = self.styles_template.rendered_size(replaced_colors)
+        after = self.__compile_templates()[self.main_styles].rendered_size(replaced_colors)
+
+        return f" ({self.main_styles}: {before / 1024:.1f} KB -> {after / 1024:.1f} KB)"
+
+    def render(self, flavor, accent):
+        """
+        Generate theme files with accent color in memory
+        :param flavor: flavor name
+        :param accent: accent color name
+        :return: {file name: content}
+        """
+
+        return self.render_colors(self.__apply_colors(flavor, accent))
+
+    def render_colors(self, replaced_colors):
+        """
+        Generate theme files with already collected colors in memory
+        :param replaced_colors: {keyword: replaced value}
+        :return: {file name: content}
+        """
+
+        rendered = dict(self.files)  # binary files are used as is
+        for apply_file, template in self.__compile_templates().items():
+            rendered[apply_file] = template.render(replaced_colors).encode()
+
+        return rendered
+
+    def write(self, destination, replaced_colors, digest=None, shared=False, staged=False, force=False):
+        """
+        Generate theme files and write them to a folder
+        :param destination: folder where theme will be installed
+        :param replaced_colors: {keyword: replaced value}
+        :param digest: digest of variant inputs to save in manifest (optional)
+        :param shared: if True, files without colors are hardlinked from shared store
+        :param staged: if True, files are written to a staging folder that replaces destination at once
+        :param force: if True, shared files are written to the store again
+        :return: location of replaced folder to delete, or None
+        """
+
+        rendered = self.render_colors(replaced_colors)
+        previous = manifest_files(destination) if not staged else list()
+
+        if staged:
+            target = os.path.normpath(os.path.expanduser(destination))
+            destination = staging_folder(target)
+
+        try:
+            self.__write_files(destination, rendered, digest, shared, force)
+
+            if staged:
+                # shared files are flushed once, when they are added to the store
+                written = [file for file in rendered if not shared or file not in self.static_files]
+                sync_files(destination, written + ([config.manifest_file] if digest else []))
+                return replace_folder(destination, target)
+
+            # staging folders start empty, rewritten folders can have files of the previous build.
+            # Only files listed in its manifest are removed, the folder can have other files.
+            remove_stale_files(destination, previous, rendered)
 
-    def __apply_theme(self, source, destination, flavor, accent):
+        except BaseException:
+            if staged and os.path.lexists(destination):
+                remove_folder(destination)
+            raise
+
+        return None
+
+    def __write_files(self, destination, rendered, digest, shared, force):
         """
-        Apply theme to all files in directory
-        :param hue
-        :param source
-        :param destination: file directory
-        :param sat: color saturation (optional)
+        Write generated files to a folder
+        :param destination: folder location
+        :param rendered: {file name: content}
+        :param digest: digest of variant inputs to save in manifest (optional)
+        :param shared: if True, files without colors are hardlinked from shared store
+        :param force: if True, shared files are written to the store again
         """
 
-        for apply_file in os.listdir(f"{source}/"):
-            self.__apply_colors(destination, apply_file, flavor, accent)
+        if shared:
+            write_files(destination, {file: content for file, content in rendered.items()
+                                      if file not in self.static_files})
+            link_files(self.store_folder, destination, {file: (file_digest, rendered[file])
+                                                        for file, file_digest in self.static_files.items()},
+                       force)
+        else:
+            write_files(destination, rendered)
 
-    def install(self, flavor, accent, destination=None):
+        # manifest is written last, so an interrupted install is rebuilt next time
+        if digest:
+            write_manifest(destination, digest, rendered)
+
+    def install(self, flavor, accent, destination=None, force=False, removals=None):
         """
-        Copy files and generate theme with different accent color
-        :param hue
-        :param name: theme name
-        :param sat: color saturation (optional)
+        Generate theme with different accent color and write it
+        :param flavor: flavor name
+        :param accent: accent color name
         :param destination: folder where theme will be installed
+        :param force: rebuild theme even if it is up to date
+        :param removals: list where threads deleting replaced folders are added,
+                         if None, install waits until replaced folder is deleted
         """
-        name = flavor + "-" + accent
+        name = self.variant_name(flavor, accent)
         is_dest = bool(destination)
 
         print(f"Creating {name} theme...", end=" ")
 
         try:
-            if not is_dest:
+            replaced_colors = self.__apply_colors(flavor, accent)
+
+            # build manifest is saved only in themes folder
+            if is_dest:
+                self.write(destination, replaced_colors)
+
+            else:
                 destination = destination_return(self.destination_folder, name, self.theme_type)
+                digest = self.__digest(flavor, replaced_colors)
+
+                if not force and is_up_to_date(destination, digest):
+                    print("Up to date.")
+                    return
 
-            copy_files(self.temp_folder + '/', destination)
-            self.__apply_theme(self.temp_folder, destination, flavor, accent)
+                old_folder = self.write(destination, replaced_colors, digest, shared=True, staged=True, force=force)
+                removal = remove_in_background(old_folder)
+
+                if removal and removals is None:
+                    removal.join()
+                elif removal:
+                    removals.append(removal)
 
         except Exception as err:
             print("\nError: " + str(err))
 
         else:
-            print("Done.")
+            print("Done." + self.__size_report(replaced_colors))
+
+    def install_all(self, variants, jobs=None, force=False):
+        """
+        Generate several themes in parallel
+        :param variants: ((flavor, accent), ...)
+        :param jobs: number of processes, CPU count by default
+        :param force: rebuild themes even if they are up to date
+        """
+
+        # derived colors of all variants are computed at once
+        self.palette.precompute(variants)
+
+        # replaced folders are deleted while other variants are built, and before install_all returns
+        removals = list()
+
+        try:
+            self.__install_variants(variants, jobs, force, removals)
+        finally:
+            for removal in removals:
+                removal.join()
+
+        # replaced variants could be the last users of shared files
+        clean_store(self.store_folder, referenced_files(self.destination_folder))
+
+    def __install_variants(self, variants, jobs, force, removals):
+        """
+        Generate several themes, serially or in worker processes
+        :param variants: ((flavor, accent), ...)
+        :param jobs: number of processes, CPU count by default
+        :param force: rebuild themes even if they are up to date
+        :param removals: list where threads deleting replaced folders are added
+        """
+
+        if jobs == 1 or len(variants) < 2:
+            for flavor, accent in variants:
+                self.install(flavor, accent, force=force, removals=removals)
+            return
+
+        from concurrent.futures import ProcessPoolExecutor  # imported only for parallel builds
+
+        # workers receive parsed templates and colors instead of reading files
+        tasks = list()
+        reports = list()  # size reports of variants that are built
+        for flavor, accent in variants:
+            destination = destination_return(self.destination_folder, self.variant_name(flavor, accent),
+                                             self.theme_type)
+            replaced_colors = self.__apply_colors(flavor, accent)
+            digest = self.__digest(flavor, replaced_colors)
+
+            if force or not is_up_to_date(destination, digest):
+                tasks.append((destination, replaced_colors, digest, True, True, force))
+                reports.append(self.__size_report(replaced_colors))
+            else:
+                tasks.append(None)
+
+        # processes are started only if several variants are outdated
+        if sum(task is not None for task in tasks) < 2:
+            for (flavor, accent), task in zip(variants, tasks):
+                if task is None:
+                    print(f"Creating {self.variant_name(flavor, accent)} theme... Up to date.")
+                else:
+                    self.install(flavor, accent, force=force, removals=removals)
+            return
+
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(self,)) as executor:
+            results = executor.map(_install_variant, [task for task in tasks if task])
+
+            # results come in the same order as variants, so output stays readable
+            reports = iter(reports)
+
+            for (flavor, accent), task in zip(variants, tasks):
+                if task is None:
+                    print(f"Creating {self.variant_name(flavor, accent)} theme... Up to date.")
+                    continue
+
+                (error, old_folder), report = next(results), next(reports)
+                removal = remove_in_background(old_folder)
+                if removal:
+                    removals.append(removal)
+                print(f"Creating {self.variant_name(flavor, accent)} theme...",
+                      "Done." + report if error is None else "\nError: " + error)
+
+    def apply_tweak(self, tweak):
+        """
+        Add precompiled tweak styles and files to the theme
+        :param tweak: Tweak object
+        """
+
+        self.tweaks.append(tweak.name)
+        self.fragments.append(tweak)
+        self.files.update(tweak.assets)
+
+        self.templates = None
+
+    def with_tweaks(self, tweaks):
+        """
+        Copy of the theme with more tweaks, named by tweak labels.
+        Copies share colors and compiled files, so only tweak styles are added for every combination.
+        :param tweaks: Tweak objects
+        :return: Theme object
+        """
+
+        theme = copy.copy(self)
+        theme.tweaks = list(self.tweaks)
+        theme.fragments = list(self.fragments)
+        theme.files = dict(self.files)
+        theme.templates = None
+
+        for tweak in tweaks:
+            theme.apply_tweak(tweak)
+
+        if tweaks:
+            theme.suffix = self.suffix + "-" + "+".join(tweak.label for tweak in tweaks)
+
+        return theme
 
     def add_to_start(self, content):
         """
@@ -148,8 +477,78 @@ class Theme:
         :param content: content to add
         """
 
-        with open(self.main_styles, 'r') as main_styles:
-            main_content = main_styles.read()
+        self.styles = content + '\n' + self.styles
+
+        self.templates = None
+
+    def prune(self, inventory):
+        """
+        Remove selectors from main styles that can't match anything in gnome-shell
+        :param inventory: class and id names (.name, #name) used by gnome-shell
+        :return: list of removed selectors
+        """
+
+        self.__inline_fragments()  # tweaks are pruned with main styles
+
+        pruned = list()
+        self.styles = serialize(parse(self.styles, prune_selectors(inventory, pruned)))
+
+        self.templates = None
+        return pruned
+
+    def __inline_fragments(self):
+        """
+        Add tweak styles to main styles, so they can be changed as text
+        """
+
+        self.styles += "".join('\n' + tweak.styles for tweak in self.fragments)
+        self.fragments = list()
+
+    def label_files(self, label):
+        """
+        Add a label to all theme files and change links to them in main styles
+        :param label: label to add
+        """
+
+        self.__inline_fragments()  # links in tweaks are labeled too
+        links = dict()  # {file name: labeled file name}
+
+        for filename in self.files:
+            # Skip if the file is already labeled
+            if label in filename:
+                continue
+
+            # Split the filename into name and extension
+            name, extension = os.path.splitext(filename)
+            links[filename] = f"{name}-{label}{extension}"
+
+        self.files = {links.get(filename, filename): content for filename, content in self.files.items()}
+        self.styles = Template(self.styles, links).render(links)
+
+        self.templates = None
+
+
+_worker_theme = None  # Theme object of a worker process
+
+
+def _init_worker(theme):
+    """
+    Store theme in a worker process
+    :param theme: Theme object with compiled templates
+    """
+
+    global _worker_theme
+    _worker_theme = theme
+
+
+def _install_variant(task):
+    """
+    Generate theme in a worker process
+    :param task: (destination, replaced colors, digest, shared, staged, force)
+    :return: (error message or None, replaced folder to delete or None)
+    """
 
-        with open(self.main_styles, 'w') as main_styles:
-            main_styles.write(content + '\n' + main_content)
+    try:
+        return None, _worker_theme.write(*task)
+    except Exception as err:
+        return str(err), None
@@ -0,0 +1,75 @@
+import os
+import re
+import json
+import functools
+
+from .template import compile_template  # precompiled tweak styles
+
+url_pattern = re.compile(r"""url\(\s*["']?([^"')]+)["']?\s*\)""")
+
+
+class Tweak:
+    def __init__(self, name, label, styles, assets, flags=(), group=None, help=None):
+        """
+        Styles and files that change the theme
+        :param name: tweak name, also name of command-line argument
+        :param label: short name used in names of tweak-matrix themes
+        :param styles: css added to main styles
+        :param assets: {file name: content} of files used by styles
+        :param flags: command-line flags
+        :param group: command-line argument group
+        :param help: command-line help
+        """
+
+        self.name = name
+        self.label = label
+        self.styles = styles
+        self.assets = assets
+        self.flags = flags
+        self.group = group
+        self.help = help
+
+    def template(self, keywords):
+        """
+        Compiled styles
+        :param keywords: keywords that may be replaced
+        :return: Template object
+        """
+
+        return compile_template('\n' + self.styles, frozenset(keywords))
+
+
+@functools.lru_cache(maxsize=None)
+def load_tweaks(tweaks_json):
+    """
+    Load tweaks registered in tweaks.json, files are read once per process
+    :param tweaks_json: tweaks.json location, tweak files are relative to it
+    :return: {tweak name: Tweak}
+    """
+
+    folder = os.path.dirname(tweaks_json)
+
+    with open(tweaks_json) as f:
+        registry = json.load(f)
+
+    tweaks = dict()
+
+    for name, tweak in registry.items():
+        styles_file = os.path.join(folder, tweak["file"])
+        with open(styles_file) as f:
+            styles = f.read()
+
+        # files linked in styles are installed with the theme
+        assets = dict()
+        for asset in url_pattern.findall(styles):
+            asset_file = os.path.join(os.path.dirname(styles_file), asset)
+
+            if os.path.isfile(asset_file):
+                with open(asset_file, "rb") as f:
+                    assets[os.path.basename(asset)] = f.read()
+
+        label = os.path.splitext(os.path.basename(styles_file))[0]
+        tweaks[name] = Tweak(name, label, styles, assets, tweak.get("flags", (f"--{name}",)), tweak.get("group"),
+                             tweak.get("help"))
+
+    return tweaks
@@ -1,21 +1,168 @@
 import os
+import hashlib
+import functools
 from . import config  # name of folders and files
+from .fileops import remove_folder  # delete folders without spawning processes
 
 
-def generate_file(folder, final_file):
+@functools.lru_cache(maxsize=None)
+def generate_file(folder):
     """
-    Combines all files in a folder into a single file
+    Combines all files in a folder into a single string.
+    Files are read once per process.
     :param folder: source folder
-    :param final_file: location where file will be created
+    :return: combined content
     """
 
-    opened_file = open(final_file, "w")
+    content = list()
 
-    for file in os.listdir(folder):
+    for file in sorted(os.listdir(folder)):
         with open(folder + file) as f:
-            opened_file.write(f.read() + '\n')
+            content.append(f.read() + '\n')
 
-    opened_file.close()
+    return "".join(content)
+
+
+@functools.lru_cache(maxsize=None)
+def read_files(folder):
+    """
+    Load all files from a folder to memory.
+    Files are read once per process.
+    :param folder: source folder
+    :return: ((file name, content), ...)
+    """
+
+    files = list()
+
+    for file in sorted(os.listdir(folder)):
+        path = os.path.join(folder, file)
+
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                files.append((file, f.read()))
+
+    return tuple(files)
+
+
+def write_files(destination, files):
+    """
+    Write files from memory to a folder
+    :param destination: where files will be written
+    :param files: {file name: content}
+    """
+
+    destination = os.path.expanduser(destination)  # expand ~ to /home/user
+    os.makedirs(destination, exist_ok=True)
+
+    for file, content in files.items():
+        path = os.path.join(destination, file)
+
+        # file can be a hardlink to shared store, so it is replaced instead of rewritten
+        if os.path.lexists(path):
+            os.remove(path)
+
+        with open(path, "wb") as f:
+            f.write(content)
+
+
+def remove_stale_files(destination, previous, current):
+    """
+    Remove files of a previous build that are no longer generated, other files in the folder are kept
+    :param destination: folder location
+    :param previous: names of files from the previous build
+    :param current: names of generated files
+    """
+
+    destination = os.path.expanduser(destination)
+
+    for file in previous:
+        path = os.path.join(destination, file)
+        if file not in current and os.path.basename(file) == file and os.path.isfile(path):
+            os.remove(path)
+
+
+def is_stored(stored_file, digest):
+    """
+    Check if shared file exists and wasn't changed through one of its links
+    :param stored_file: file location in shared store
+    :param digest: digest of expected content
+    :return: True if file can be linked
+    """
+
+    try:
+        with open(stored_file, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest() == digest
+    except OSError:
+        return False
+
+
+def link_files(store, destination, files, force=False):
+    """
+    Hardlink files from a shared store to a folder.
+    Missing or changed files are added to the store, file is copied if it can't be linked.
+    :param store: folder with shared files
+    :param destination: where files will be linked
+    :param files: {file name: (digest, content)}
+    :param force: if True, shared files are written again even if they are unchanged
+    """
+
+    store = os.path.expanduser(store)
+    destination = os.path.expanduser(destination)
+    os.makedirs(store, exist_ok=True)
+    os.makedirs(destination, exist_ok=True)
+
+    for file, (digest, content) in files.items():
+        stored_file = os.path.join(store, digest + os.path.splitext(file)[1])
+        path = os.path.join(destination, file)
+
+        if force or not is_stored(stored_file, digest):
+            # a new file replaces a changed one, so other links keep the old inode until they are rebuilt.
+            # Other processes can add the same file at the same time, content is the same.
+            temp_file = f"{stored_file}.{os.getpid()}"
+            with open(temp_file, "wb") as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+
+            try:
+                os.replace(temp_file, stored_file)
+            finally:
+                if os.path.lexists(temp_file):
+                    os.remove(temp_file)
+
+        # already linked
+        if os.path.exists(path) and os.path.samefile(path, stored_file):
+            continue
+
+        if os.path.lexists(path):
+            os.remove(path)
+
+        try:
+            os.link(stored_file, path)
+
+        except OSError:
+            # store is on another filesystem or links are not supported
+            with open(path, "wb") as f:
+                f.write(content)
+
+
+def clean_store(store, referenced):
+    """
+    Remove shared files that installed variants don't use
+    :param store: folder with shared files
+    :param referenced: names of shared files listed in manifests of installed variants
+    """
+
+    store = os.path.expanduser(store)
+    if not os.path.isdir(store):
+        return
+
+    for file in os.listdir(store):
+        path = os.path.join(store, file)
+
+        # linked files can belong to a variant that is installed right now, before its manifest is written
+        if file not in referenced and os.path.isfile(path) and os.stat(path).st_nlink == 1:
+            os.remove(path)
 
 
 def concatenate_files(edit_file, file):
@@ -56,12 +203,12 @@ def remove_files():
                 found_folder = False
 
                 for folder in folders:
-                    if folder.startswith("Marble"):
+                    if folder.startswith("Marble") or folder == config.store_folder:
                         folder_path = os.path.join(os.path.expanduser(path), folder)
                         print(f"Deleting folder {folder_path}...", end='')
 
                         try:
-                            os.system(f"rm -r {folder_path}")
+                            remove_folder(folder_path)
 
                         except Exception as e:
                             print(f"Error deleting folder {folder_path}: {e}")
@@ -87,143 +234,3 @@ def destination_return(themes_folder, path_name, theme_type):
     """
 
     return f"{themes_folder}/Marble-{path_name}-/{theme_type}/"
-
-
-def copy_files(source, destination):
-    """
-    Copy files from the source to another directory
-    :param source: where files will be copied
-    :param destination: where files will be pasted
-    """
-
-    destination = os.path.expanduser(destination)  # expand ~ to /home/user
-    os.makedirs(destination, exist_ok=True)
-    os.system(f"cp -aT {source} {destination}")
-
-
-def replace_keywords(file, *args):
-    """
-    Replace file with several keywords
-    :param file: file name where keywords must be replaced
-    :param args: (keyword, replacement), (...), ...
-    """
-
-    # skip binary files in project
-    if not file.lower().endswith(('.css', '.scss', '.svg')):
-        return
-
-    with open(file, "r") as read_file:
-        content = read_file.read()
-
-    for keyword, replacement in args:
-        content = content.replace(keyword, replacement)
-
-    with open(file, "w") as write_file:
-        write_file.write(content)
-
-
-def hex_to_rgba(hex_color):
-    """
-    Convert hex(a) to rgba
-    :param hex_color: input value
-    """
-
-    try:
-        if len(hex_color) in range(6, 10):
-            hex_color = hex_color.lstrip('#') + "ff"
-            # if is convertable
-            int(hex_color[:], 16)
-        else:
-            raise ValueError
-
-    except ValueError:
-        raise ValueError(f'Error: Invalid HEX color code: {hex_color}')
-
-    else:
-        return int(hex_color[0:2], 16), \
-            int(hex_color[2:4], 16), \
-            int(hex_color[4:6], 16), \
-            int(hex_color[6:8], 16) / 255
-
-
-def label_files(directory, label, *args):
-    """
-    Add a label to all files in a directory
-    :param directory: folder where files are located
-    :param label: label to add
-    :param args: files to change links to labeled files
-    :return:
-    """
-
-    # Open all files
-    files = [open(file, 'r') for file in args]
-    read_files = []
-
-    filenames = []
-
-    for filename in os.listdir(directory):
-        # Skip if the file is already labeled
-        if label in filename:
-            continue
-
-        # Split the filename into name and extension
-        name, extension = os.path.splitext(filename)
-
-        # Form the new filename and rename the file
-        new_filename = f"{name}-{label}{extension}"
-        os.rename(os.path.join(directory, filename), os.path.join(directory, new_filename))
-
-        filenames.append((filename, new_filename))
-
-    # Replace the filename in all files
-    for i, file in enumerate(files):
-        read_file = file.read()
-        read_file.replace(filenames[i][0], filenames[i][1])
-        read_files.append(read_file)
-        file.close()
-
-    write_files = [open(file, 'w') for file in args]
-
-    # Write the changes to the files and close them
-    for i, file in enumerate(write_files):
-        file.write(read_files[i])
-        file.close()
-
-
-def remove_properties(file, *args):
-    """
-    Remove properties from a file
-    :param file: file name
-    :param args: properties to remove
-    """
-
-    new_content = ""
-
-    with open(file, "r") as read_file:
-        content = read_file.read()
-
-        for line in content.splitlines():
-            if not any(prop in line for prop in args):
-                new_content += line + "\n"
-            elif "}" in line:
-                new_content += "}\n"
-
-    with open(file, "w") as write_file:
-        write_file.write(new_content)
-
-
-def remove_keywords(file, *args):
-    """
-    Remove keywords from a file
-    :param file: file name
-    :param args: keywords to remove
-    """
-
-    with open(file, "r") as read_file:
-        content = read_file.read()
-
-        for arg in args:
-            content = content.replace(arg, "")
-
-    with open(file, "w") as write_file:
-        write_file.write(content)
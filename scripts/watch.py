@@ -0,0 +1,301 @@
+import os
+import time
+import errno
+import ctypes
+import select
+import struct
+import shutil
+import subprocess
+
+from .utils import generate_file, read_files
+from .tweaks import load_tweaks
+
+# inotify definitions from sys/inotify.h
+in_close_write = 0x008
+in_moved_from = 0x040
+in_moved_to = 0x080
+in_create = 0x100
+in_delete = 0x200
+in_cloexec = 0o2000000
+inotify_event = struct.Struct("iIII")  # watch descriptor, mask, cookie, name length
+
+debounce_time = 0.05  # editors write files in several steps
+
+
+def watched_folders(*folders):
+    """
+    Collect folders with their subfolders
+    :param folders: top folders
+    :return: list of folders
+    """
+
+    return [root for folder in folders for root, _, _ in os.walk(folder)]
+
+
+def is_temporary(path):
+    """
+    Check if file is a temporary file of an editor
+    :param path: file location
+    """
+
+    name = os.path.basename(path)
+    return name.startswith((".", "#")) or name.endswith(("~", ".swp", ".tmp"))
+
+
+class InotifyWatcher:
+    def __init__(self, folders):
+        """
+        Wait for file changes with inotify
+        :param folders: folders to watch, without subfolders
+        """
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+
+        self.fd = libc.inotify_init1(in_cloexec)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.folders = dict()  # {watch descriptor: folder}
+        mask = in_close_write | in_moved_from | in_moved_to | in_create | in_delete
+
+        for folder in folders:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(folder), mask)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"can't watch {folder}")
+
+            self.folders[wd] = folder
+
+    def wait(self):
+        """
+        Wait for changes
+        :return: set of changed file locations
+        """
+
+        changed = set()
+        timeout = None  # wait for the first change, then for the rest of the changes
+
+        while select.select([self.fd], [], [], timeout)[0]:
+            data = os.read(self.fd, 1 << 16)
+            position = 0
+
+            while position < len(data):
+                wd, mask, cookie, length = inotify_event.unpack_from(data, position)
+                position += inotify_event.size
+                name = data[position:position + length].rstrip(b"\0").decode()
+                position += length
+
+                if wd in self.folders and name:
+                    changed.add(os.path.join(self.folders[wd], name))
+
+            timeout = debounce_time
+
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    def __init__(self, folders, interval=0.25):
+        """
+        Wait for file changes by checking modification time
+        :param folders: folders to watch, without subfolders
+        :param interval: seconds between checks
+        """
+
+        self.folders = folders
+        self.interval = interval
+        self.files = self.snapshot()
+
+    def snapshot(self):
+        """
+        :return: {file location: (modification time, size)}
+        """
+
+        files = dict()
+
+        for folder in self.folders:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+
+        return files
+
+    def wait(self):
+        """
+        Wait for changes
+        :return: set of changed file locations
+        """
+
+        while True:
+            time.sleep(self.interval)
+            files = self.snapshot()
+
+            changed = set(path for path in files.keys() | self.files.keys()
+                          if files.get(path) != self.files.get(path))
+            self.files = files
+
+            if changed:
+                return changed
+
+    def close(self):
+        pass
+
+
+def reload_shell_theme(theme_name):
+    """
+    Make gnome-shell load changed user theme again
+    :param theme_name: installed theme name (Marble-mocha-blue-)
+    """
+
+    if not shutil.which("gsettings"):
+        print("gsettings is not found, theme is not reloaded.")
+        return
+
+    # shell loads theme when its name changes
+    schema = ("org.gnome.shell.extensions.user-theme", "name")
+    for name in ("", theme_name):
+        subprocess.run(["gsettings", "set", *schema, name], check=False)
+
+
+class ThemeWatcher:
+    def __init__(self, create_theme, variants, folders, reload=False):
+        """
+        Rebuild theme variants when theme files change
+        :param create_theme: function that creates Theme object with tweaks
+        :param variants: ((flavor, accent), ...) to rebuild
+        :param folders: folders to watch
+        :param reload: if True, gnome-shell reloads theme after rebuild
+        """
+
+        self.create_theme = create_theme
+        self.variants = variants
+        self.folders = folders
+        self.reload = reload
+
+        self.theme = None
+        self.partials = dict()  # {file name: content} of main styles
+        self.tail = None        # styles added after partials (tweaks), None if styles are changed in other way
+
+    def load(self):
+        """
+        Create theme from files on disk
+        """
+
+        generate_file.cache_clear()
+        read_files.cache_clear()
+        load_tweaks.cache_clear()
+        self.theme = self.create_theme()
+
+        styles_folder = f"{self.theme.theme_folder}_css"
+        self.partials = dict()
+        for file in os.listdir(styles_folder):
+            with open(os.path.join(styles_folder, file)) as f:
+                self.partials[file] = f.read()
+
+        partials = self.join_partials()
+        self.tail = self.theme.styles[len(partials):] if self.theme.styles.startswith(partials) else None
+
+    def join_partials(self):
+        """
+        Combine partials like generate_file
+        :return: main styles without tweaks
+        """
+
+        return "".join(self.partials[file] + '\n' for file in sorted(self.partials))
+
+    def update(self, paths):
+        """
+        Apply changed files to the theme in memory.
+        Only changed files are read, theme is created again if other files change.
+        :param paths: changed file locations
+        """
+
+        styles_folder = os.path.abspath(f"{self.theme.theme_folder}_css")
+        files_folder = os.path.abspath(self.theme.theme_folder)
+        styles_changed = False
+
+        for path in paths:
+            folder, file = os.path.split(os.path.abspath(path))
+
+            if folder == styles_folder and self.tail is not None:
+                if os.path.isfile(path):
+                    with open(path) as f:
+                        self.partials[file] = f.read()
+                else:
+                    self.partials.pop(file, None)
+
+                styles_changed = True
+
+            elif folder == files_folder:
+                if os.path.isfile(path):
+                    with open(path, "rb") as f:
+                        self.theme.files[file] = f.read()
+                else:
+                    self.theme.files.pop(file, None)
+
+                self.theme.templates = None
+
+            else:
+                # tweaks or other files
+                self.load()
+                return
+
+        if styles_changed:
+            self.theme.styles = self.join_partials() + self.tail
+            self.theme.templates = None
+
+    def build(self):
+        """
+        Install watched variants, unchanged variants are skipped by build cache
+        """
+
+        start = time.perf_counter()
+        self.theme.install_all(self.variants, jobs=1)
+        print(f"Rebuilt in {(time.perf_counter() - start) * 1000:.0f} ms.")
+
+        if self.reload:
+            flavor, accent = self.variants[0]
+            reload_shell_theme(f"Marble-{self.theme.variant_name(flavor, accent)}-")
+
+    def run(self):
+        """
+        Rebuild themes until interrupted with Ctrl+C
+        """
+
+        folders = watched_folders(*self.folders)
+
+        try:
+            watcher = InotifyWatcher(folders)
+        except OSError as err:
+            print(f"inotify is not available ({err.strerror}), checking files periodically.")
+            watcher = PollingWatcher(folders)
+
+        self.load()
+        self.build()
+        print(f"Watching {', '.join(self.folders)} for changes. Press Ctrl+C to stop.")
+
+        try:
+            while True:
+                changed = [path for path in watcher.wait() if not is_temporary(path)]
+                if not changed:
+                    continue
+
+                print("\nChanged: " + ", ".join(sorted(os.path.relpath(path) for path in changed)))
+
+                try:
+                    self.update(changed)
+                    self.build()
+                except Exception as err:
+                    print("Error: " + str(err))
+
+        except KeyboardInterrupt:
+            print()
+
+        finally:
+            watcher.close()